@@ -0,0 +1,83 @@
+import os
+import argparse
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from skimage import data
+
+import lrf
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Train the preset zlib dictionary for IMF thumbnails."
+    )
+    parser.add_argument(
+        "--size", type=int, default=256, help="dictionary size in bytes (default: 256)"
+    )
+    parser.add_argument(
+        "--save_path",
+        type=str,
+        default="../../lrf/compression/dictionaries/imf_thumbnails.zdict",
+        help="where to save the dictionary",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+
+    args = parser.parse_args()
+
+    return args
+
+
+def make_thumbnails(images, sizes, rng, num_crops=3):
+    thumbnails = []
+    for image in images:
+        image = torch.from_numpy(image).permute(2, 0, 1)[None, :3].float()
+        height, width = image.shape[-2:]
+        for size in sizes:
+            for _ in range(num_crops):
+                crop = rng.integers(min(height, width) // 2, min(height, width) + 1)
+                top = rng.integers(0, height - crop + 1)
+                left = rng.integers(0, width - crop + 1)
+                thumbnail = image[..., top : top + crop, left : left + crop]
+                thumbnail = F.interpolate(thumbnail, size=(size, size), mode="area")
+                thumbnails.append(thumbnail[0].round().clamp(0, 255).to(torch.uint8))
+    return thumbnails
+
+
+def get_fibers(image, quality):
+    _, encoded_factors = lrf.separate_bytes(lrf.imf_encode(image, quality=quality))
+    fibers = []
+    for encoded_factor in lrf.separate_bytes(encoded_factors, 6):
+        factor = lrf.decode_tensor(encoded_factor).numpy()
+        fibers.extend(np.ascontiguousarray(column).tobytes() for column in factor.T)
+    return fibers
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = [
+        data.astronaut(),
+        data.coffee(),
+        data.chelsea(),
+        data.rocket(),
+        data.hubble_deep_field(),
+        data.immunohistochemistry(),
+        data.retina(),
+    ]
+    thumbnails = make_thumbnails(images, [48, 64, 96, 128], rng)
+    samples = [
+        fiber
+        for thumbnail in thumbnails
+        for quality in (5, 10, 20, 30)
+        for fiber in get_fibers(thumbnail, quality)
+    ]
+
+    dictionary = lrf.train_zlib_dictionary(samples, size=args.size)
+    os.makedirs(os.path.dirname(args.save_path), exist_ok=True)
+    with open(args.save_path, "wb") as f:
+        f.write(dictionary)
+
+    print(f"trained a {len(dictionary)}-byte dictionary on {len(samples)} fibers")
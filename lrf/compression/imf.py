@@ -1,26 +1,43 @@
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Sequence
 import math
 
 import torch
 from einops import rearrange
 
-from lrf.factorization import IMF
+from lrf.factorization import IMF, bucketed_imf
 from lrf.compression.utils import (
     rgb_to_ycbcr,
     ycbcr_to_rgb,
+    ycbcr_to_rgb_int,
     chroma_downsampling,
     chroma_upsampling,
+    chroma_upsampling_int,
     pad_image,
     unpad_image,
     to_dtype,
-    dict_to_bytes,
-    bytes_to_dict,
+    image_header_to_bytes,
+    bytes_to_image_header,
     combine_bytes,
     separate_bytes,
-    encode_tensor,
-    decode_tensor,
+    separate_layers,
+    encode_layers,
+    decode_layers,
+    worker_pool,
+    dpcm_decode,
+    dpcm_encode_factors,
+    dpcm_decode_factors,
+    downscale_factors,
+    downscale_metadata,
+    DecodeWorkspace,
+    reconstruct_image_into,
+    reconstruct_image_pipelined,
+    tensor_block_rows,
 )
 
+# The number of pixels from which `imf_decode` reconstructs strip by strip, which is
+# faster for large images only
+STRIP_DECODE_PIXELS = 2**21
+
 
 def imf_rank(size: tuple[int, int], com_ratio: float) -> int:
     """Calculate the rank for IMF based on the compression ratio.
@@ -44,7 +61,7 @@ def patchify(x: torch.Tensor, patch_size: tuple[int, int]) -> torch.Tensor:
     """Splits an input image into flattened patches.
 
     Args:
-        x (torch.Tensor): The input image tensor of shape (channel, height, width).
+        x (torch.Tensor): The input image tensor of shape (..., channel, height, width).
         patch_size (tuple[int, int]): The patch size.
 
     Returns:
@@ -52,7 +69,7 @@ def patchify(x: torch.Tensor, patch_size: tuple[int, int]) -> torch.Tensor:
     """
 
     p, q = patch_size
-    patches = rearrange(x, "c (h p) (w q) -> (h w) (c p q)", p=p, q=q)
+    patches = rearrange(x, "... c (h p) (w q) -> ... (h w) (c p q)", p=p, q=q)
     return patches
 
 
@@ -71,7 +88,9 @@ def depatchify(
     """
 
     p, q = patch_size
-    patches = rearrange(x, "(h w) (c p q) -> c (h p) (w q)", p=p, q=q, h=size[0] // p)
+    patches = rearrange(
+        x, "... (h w) (c p q) -> ... c (h p) (w q)", p=p, q=q, h=size[0] // p
+    )
     return patches
 
 
@@ -123,8 +142,16 @@ def imf_encode(
     patch_size: tuple[int, int] = (8, 8),
     bounds: tuple[float, float] = (-16, 15),
     dtype: torch.dtype = torch.int8,
+    coder: str = "zlib",
+    pack: bool = False,
+    num_workers: int = 1,
+    dictionary: Optional[int] = None,
+    prediction: bool = False,
+    layers: int = 1,
+    block_rows: Optional[int] = None,
+    return_losses: bool = False,
     **kwargs,
-) -> bytes:
+) -> bytes | tuple[bytes, list[torch.Tensor]]:
     """
     IMF compression of an image.
 
@@ -138,10 +165,272 @@ def imf_encode(
         patch_size (tuple[int, int], optional): The patch size (default: (8, 8)).
         bounds (tuple[float, float], optional): The bounds for IMF (default: (-16, 15)).
         dtype (torch.dtype, optional): The data type for encoding (default: torch.int8).
+        coder (str, optional): The entropy coder of the factors, e.g., 'zlib', 'zlib-6',
+            'lzma', 'bz2', 'rans' or 'none' (see `entropy_encode`, default: 'zlib').
+        pack (bool, optional): Whether to bit-pack the factors to the bit width of
+            `bounds` (see `pack_bits`) before entropy coding, e.g., with `coder='none'`
+            (default: False).
+        num_workers (int, optional): The number of threads that compress the fibers of
+            the factors (default: 1).
+        dictionary (int, optional): The ID of a preset zlib dictionary (see
+            `zlib_dictionary`) for the factors, which helps small images (default: None).
+        prediction (bool, optional): Whether to code the u factors as residuals against
+            the neighbor patches, with a DPCM mode per component chosen by trial
+            compression (see `dpcm_modes`). Requires `patch` (default: False).
+        layers (int, optional): The number of rank-ordered layers of the factors (see
+            `encode_layers`). With several layers, `imf_decode` can reconstruct a preview
+            from a prefix of the bitstream (default: 1).
+        block_rows (int, optional): Store the u factors in blocks of this many rows of
+            patches, so that `imf_decode` can decode a region of interest from only the
+            blocks covering it. Requires `patch` (default: None).
+        return_losses (bool, optional): Whether to also return the per-iteration loss history
+            of each factorized matrix (default: False).
         **kwargs: Additional arguments for IMF decomposition.
 
     Returns:
-        bytes: The encoded image in bytes.
+        bytes: The encoded image in bytes. If `return_losses` is True, a tuple of the encoded
+            image and a list with one loss history per channel (one for RGB, three for YCbCr).
+    """
+
+    outputs = imf_encode_batch(
+        image.unsqueeze(0),
+        rank=rank,
+        quality=quality,
+        color_space=color_space,
+        scale_factor=scale_factor,
+        patch=patch,
+        patch_size=patch_size,
+        bounds=bounds,
+        dtype=dtype,
+        coder=coder,
+        pack=pack,
+        num_workers=num_workers,
+        dictionary=dictionary,
+        prediction=prediction,
+        layers=layers,
+        block_rows=block_rows,
+        return_losses=return_losses,
+        **kwargs,
+    )
+
+    if return_losses:
+        encoded_images, losses = outputs
+        return encoded_images[0], losses[0]
+
+    return outputs[0]
+
+
+def imf_encode_batch(
+    images: torch.Tensor | Sequence[torch.Tensor],
+    rank: Optional[int | tuple[int, int, int]] = None,
+    quality: Optional[float | tuple[float, float, float]] = None,
+    color_space: str = "YCbCr",
+    scale_factor: tuple[float, float] = (0.5, 0.5),
+    patch: bool = True,
+    patch_size: tuple[int, int] = (8, 8),
+    bounds: tuple[float, float] = (-16, 15),
+    dtype: torch.dtype = torch.int8,
+    coder: str = "zlib",
+    pack: bool = False,
+    num_workers: int = 1,
+    dictionary: Optional[int] = None,
+    prediction: bool = False,
+    layers: int = 1,
+    block_rows: Optional[int] = None,
+    return_losses: bool = False,
+    **kwargs,
+) -> list[bytes] | tuple[list[bytes], list[list[torch.Tensor]]]:
+    """
+    IMF compression of a batch of images.
+
+    Color conversion and patchification run once per stack of same-size images. The
+    matrices of all channels of all images are then bucketed by shape and rank (see
+    `bucketed_imf`), so that, e.g., the Cb and Cr channels of every image are factorized
+    by one batched solver call. Each image gets its own factors and its own bitstream,
+    which `imf_decode` reads just like the output of `imf_encode`.
+
+    Args:
+        images (torch.Tensor or Sequence[torch.Tensor]): The input images, either a tensor
+            of shape (B, C, H, W) or a sequence of B tensors of shape (C, H, W), possibly
+            of different sizes.
+        rank (int or tuple[int, int, int], optional): The rank for IMF (default: None).
+        quality (float or tuple[float, float, float], optional): The quality for IMF (default: None).
+        color_space (str, optional): The color space of the images ('RGB' or 'YCbCr', default: 'YCbCr').
+        scale_factor (tuple[float, float], optional): The scale factor for chroma downsampling (default: (0.5, 0.5)).
+        patch (bool, optional): Whether to use patch-based encoding (default: True).
+        patch_size (tuple[int, int], optional): The patch size (default: (8, 8)).
+        bounds (tuple[float, float], optional): The bounds for IMF (default: (-16, 15)).
+        dtype (torch.dtype, optional): The data type for encoding (default: torch.int8).
+        coder (str, optional): The entropy coder of the factors, e.g., 'zlib', 'zlib-6',
+            'lzma', 'bz2', 'rans' or 'none' (see `entropy_encode`, default: 'zlib').
+        pack (bool, optional): Whether to bit-pack the factors to the bit width of
+            `bounds` (see `pack_bits`) before entropy coding, e.g., with `coder='none'`
+            (default: False).
+        num_workers (int, optional): The number of threads that compress the fibers of
+            the factors (default: 1).
+        dictionary (int, optional): The ID of a preset zlib dictionary (see
+            `zlib_dictionary`) for the factors, which helps small images (default: None).
+        prediction (bool, optional): Whether to code the u factors as residuals against
+            the neighbor patches, with a DPCM mode per component chosen by trial
+            compression (see `dpcm_modes`). Requires `patch` (default: False).
+        layers (int, optional): The number of rank-ordered layers of the factors (see
+            `encode_layers`). With several layers, `imf_decode` can reconstruct a preview
+            from a prefix of the bitstream (default: 1).
+        block_rows (int, optional): Store the u factors in blocks of this many rows of
+            patches, so that `imf_decode` can decode a region of interest from only the
+            blocks covering it. Requires `patch` (default: None).
+        return_losses (bool, optional): Whether to also return the per-iteration loss history
+            of each factorized matrix (default: False).
+        **kwargs: Additional arguments for IMF decomposition.
+
+    Returns:
+        list[bytes]: The encoded images in bytes. If `return_losses` is True, a tuple of the
+            encoded images and, for each image, a list with one loss history per channel.
+    """
+
+    assert (rank, quality) != (
+        None,
+        None,
+    ), "Either 'rank' or 'quality' must be specified."
+
+    assert color_space in (
+        "RGB",
+        "YCbCr",
+    ), "`color_space` must be one of 'RGB' or 'YCbCr'."
+
+    assert not prediction or (
+        patch and not pack
+    ), "'prediction' requires 'patch' and is incompatible with 'pack'."
+    assert block_rows is None or patch, "'block_rows' requires 'patch'."
+    assert (
+        dictionary is None or coder.partition("-")[0] == "zlib"
+    ), "'dictionary' requires the 'zlib' coder."
+
+    # stack images of the same size
+    if isinstance(images, torch.Tensor):
+        assert images.ndim == 4, "'images' must be of shape (B, C, H, W)."
+        stacks = [(list(range(len(images))), images)]
+    else:
+        images = list(images)
+        sizes = {}
+        for b, image in enumerate(images):
+            sizes.setdefault(tuple(image.shape), []).append(b)
+        stacks = [(idx, torch.stack([images[b] for b in idx])) for idx in sizes.values()]
+
+    rank, quality = _channel_params(rank, quality, color_space)
+    packing = _packing_bounds(bounds) if pack else None
+
+    # prepare the matrices of all channels of all stacks
+    matrices, ranks, headers = [], [], []
+    for indices, stack in stacks:
+        channels, metadata = _imf_matrices(
+            stack, color_space, scale_factor, patch, patch_size, bounds
+        )
+        channel_ranks = [
+            _channel_rank(x, rank[i], quality[i]) for i, x in enumerate(channels)
+        ]
+        matrices.extend(channels)
+        ranks.extend(channel_ranks)
+
+        headers.append((indices, len(channels), _with_rank(metadata, channel_ranks)))
+
+    # factorize all matrices, bucketed by shape and rank into few solver calls
+    outputs = bucketed_imf(
+        matrices, ranks, return_losses, bounds=bounds, factor=(0, 1), **kwargs
+    )
+
+    num_images = sum(len(indices) for indices, *_ in headers)
+    encoded_images, losses = [None] * num_images, [None] * num_images
+    start = 0
+    with worker_pool(num_workers) as executor:
+        for indices, num_channels, metadata in headers:
+            channel_outputs = outputs[start : start + num_channels]
+            start += num_channels
+            for j, b in enumerate(indices):
+                factors = [f[j].to(dtype) for u, v, *_ in channel_outputs for f in (u, v)]
+                factors, encoded_metadata = _encode_metadata(
+                    factors, metadata, coder, dictionary, prediction
+                )
+                encoded_layers = encode_layers(
+                    factors,
+                    layers,
+                    _block_rows(metadata, block_rows),
+                    coder=coder,
+                    bounds=packing,
+                    executor=executor,
+                    dictionary=dictionary,
+                )
+                encoded_images[b] = combine_bytes([encoded_metadata, *encoded_layers])
+                if return_losses:
+                    losses[b] = [loss[:, j] for *_, loss in channel_outputs]
+
+    if return_losses:
+        return encoded_images, losses
+
+    return encoded_images
+
+
+def imf_encode_nested(
+    image: torch.Tensor,
+    rank: Optional[Sequence[int | tuple[int, int, int]]] = None,
+    quality: Optional[Sequence[float | tuple[float, float, float]]] = None,
+    color_space: str = "YCbCr",
+    scale_factor: tuple[float, float] = (0.5, 0.5),
+    patch: bool = True,
+    patch_size: tuple[int, int] = (8, 8),
+    bounds: tuple[float, float] = (-16, 15),
+    dtype: torch.dtype = torch.int8,
+    coder: str = "zlib",
+    pack: bool = False,
+    num_workers: int = 1,
+    dictionary: Optional[int] = None,
+    prediction: bool = False,
+    layers: int = 1,
+    block_rows: Optional[int] = None,
+    **kwargs,
+) -> list[bytes]:
+    """
+    IMF compression of an image at several quality levels from one factorization run.
+
+    Each channel is factorized once with `IMF.decompose_nested`, which grows the rank
+    step by step and warm-starts every rank from the integer factors of the previous
+    one. Repeated ranks (e.g., close qualities) are factorized only once.
+
+    Args:
+        image (torch.Tensor): The input image tensor.
+        rank (Sequence[int or tuple[int, int, int]], optional): The ranks, one per
+            quality level (default: None).
+        quality (Sequence[float or tuple[float, float, float]], optional): The qualities,
+            one per quality level (default: None).
+        color_space (str, optional): The color space of the image ('RGB' or 'YCbCr', default: 'YCbCr').
+        scale_factor (tuple[float, float], optional): The scale factor for chroma downsampling (default: (0.5, 0.5)).
+        patch (bool, optional): Whether to use patch-based encoding (default: True).
+        patch_size (tuple[int, int], optional): The patch size (default: (8, 8)).
+        bounds (tuple[float, float], optional): The bounds for IMF (default: (-16, 15)).
+        dtype (torch.dtype, optional): The data type for encoding (default: torch.int8).
+        coder (str, optional): The entropy coder of the factors, e.g., 'zlib', 'zlib-6',
+            'lzma', 'bz2', 'rans' or 'none' (see `entropy_encode`, default: 'zlib').
+        pack (bool, optional): Whether to bit-pack the factors to the bit width of
+            `bounds` (see `pack_bits`) before entropy coding, e.g., with `coder='none'`
+            (default: False).
+        num_workers (int, optional): The number of threads that compress the fibers of
+            the factors (default: 1).
+        dictionary (int, optional): The ID of a preset zlib dictionary (see
+            `zlib_dictionary`) for the factors, which helps small images (default: None).
+        prediction (bool, optional): Whether to code the u factors as residuals against
+            the neighbor patches, with a DPCM mode per component chosen by trial
+            compression (see `dpcm_modes`). Requires `patch` (default: False).
+        layers (int, optional): The number of rank-ordered layers of the factors (see
+            `encode_layers`). With several layers, `imf_decode` can reconstruct a preview
+            from a prefix of the bitstream (default: 1).
+        block_rows (int, optional): Store the u factors in blocks of this many rows of
+            patches, so that `imf_decode` can decode a region of interest from only the
+            blocks covering it. Requires `patch` (default: None).
+        **kwargs: Additional arguments for IMF decomposition, e.g., `tol`.
+
+    Returns:
+        list[bytes]: The encoded image for each quality level, each of which can be
+            decoded with `imf_decode`.
     """
 
     assert (rank, quality) != (
@@ -154,163 +443,420 @@ def imf_encode(
         "YCbCr",
     ), "`color_space` must be one of 'RGB' or 'YCbCr'."
 
+    assert not prediction or (
+        patch and not pack
+    ), "'prediction' requires 'patch' and is incompatible with 'pack'."
+    assert block_rows is None or patch, "'block_rows' requires 'patch'."
+    assert (
+        dictionary is None or coder.partition("-")[0] == "zlib"
+    ), "'dictionary' requires the 'zlib' coder."
+
+    num_levels = len(quality) if rank is None else len(rank)
+    rank = [None] * num_levels if rank is None else rank
+    quality = [None] * num_levels if quality is None else quality
+    levels = [_channel_params(r, q, color_space) for r, q in zip(rank, quality)]
+    packing = _packing_bounds(bounds) if pack else None
+
+    channels, metadata = _imf_matrices(
+        image.unsqueeze(0), color_space, scale_factor, patch, patch_size, bounds
+    )
+
+    ranks, factors = [], []
+    for i, x in enumerate(channels):
+        channel_ranks = [_channel_rank(x, r[i], q[i]) for r, q in levels]
+        imf = IMF(rank=None, bounds=bounds, factor=(0, 1), **kwargs)
+        ranks.append(channel_ranks)
+        factors.append(imf.decompose_nested(x, channel_ranks))
+
+    encoded_images = []
+    with worker_pool(num_workers) as executor:
+        for k in range(num_levels):
+            level_factors = [
+                f[0].to(dtype) for u, v, _ in (c[k] for c in factors) for f in (u, v)
+            ]
+            level_factors, encoded_metadata = _encode_metadata(
+                level_factors,
+                _with_rank(metadata, [r[k] for r in ranks]),
+                coder,
+                dictionary,
+                prediction,
+            )
+            encoded_layers = encode_layers(
+                level_factors,
+                layers,
+                _block_rows(metadata, block_rows),
+                coder=coder,
+                bounds=packing,
+                executor=executor,
+                dictionary=dictionary,
+            )
+            encoded_images.append(combine_bytes([encoded_metadata, *encoded_layers]))
+
+    return encoded_images
+
+
+def _channel_params(
+    rank: Optional[int | tuple[int, int, int]],
+    quality: Optional[float | tuple[float, float, float]],
+    color_space: str,
+) -> tuple[tuple, tuple]:
+    """Expand the rank and quality arguments into one value per channel."""
+
+    if color_space == "RGB":
+        return (rank,), (quality,)
+
+    # color_space == "YCbCr"
+    if not isinstance(rank, Iterable):
+        if rank is None:
+            rank = (None, None, None)
+        else:
+            rank = (rank, max(rank // 2, 1), max(rank // 2, 1))
+
+    if not isinstance(quality, Iterable):
+        if quality is None:
+            quality = (None, None, None)
+        else:
+            quality = (quality, quality / 2, quality / 2)
+
+    return rank, quality
+
+
+def _channel_rank(x: torch.Tensor, rank: Optional[int], quality: Optional[float]) -> int:
+    """Determine the rank of a channel matrix from its rank or quality argument."""
+
+    if rank is None:
+        assert quality >= 0 and quality <= 100, "'quality' must be between 0 and 100."
+        return max(round(min(x.shape[-2:]) * quality / 100), 1)
+
+    return rank
+
+
+def _imf_matrices(
+    images: torch.Tensor,
+    color_space: str,
+    scale_factor: tuple[float, float],
+    patch: bool,
+    patch_size: tuple[int, int],
+    bounds: tuple[float, float],
+) -> tuple[list[torch.Tensor], dict]:
+    """Convert a stack of same-size images into one matrix (batch) per channel.
+
+    Returns:
+        tuple[list[torch.Tensor], dict]: The channel matrices, each of shape (B, M, N),
+            and the metadata of the images, without their ranks.
+    """
+
     metadata = {
-        "dtype": str(image.dtype).split(".")[-1],
+        "dtype": str(images.dtype).split(".")[-1],
         "color space": color_space,
         "patch": patch,
         "bounds": bounds,
     }
 
+    images = images.float()
+
     if color_space == "RGB":
-        if patch:
-            image = image.float()
+        channels = (images,)
+    else:  # color_space == "YCbCr"
+        ycbcr = rgb_to_ycbcr(images)
+        channels = chroma_downsampling(ycbcr, scale_factor=scale_factor, mode="area")
 
-            x = pad_image(image, patch_size, mode="reflect")
-            padded_size = x.shape[-2:]
+    matrices, original_sizes, padded_sizes = [], [], []
+    for channel in channels:
+        if patch:
+            x = pad_image(channel, patch_size, mode="reflect")
+            padded_sizes.append(x.shape[-2:])
             x = patchify(x, patch_size)
+        else:
+            x = channel
 
-            if rank is None:
-                assert (
-                    quality >= 0 and quality <= 100
-                ), "'quality' must be between 0 and 100."
-                R = max(round(min(x.shape[-2:]) * quality / 100), 1)
-            else:
-                R = rank
-
-            metadata.update(
-                {
-                    "patch size": patch_size,
-                    "original size": image.shape[-2:],
-                    "padded size": padded_size,
-                    "rank": R,
-                }
-            )
+        original_sizes.append(channel.shape[-2:])
+        matrices.append(x)
 
-            imf = IMF(rank=R, bounds=bounds, factor=(0, 1), **kwargs)
-            u, v, _ = imf.decompose(x.unsqueeze(0))
-            u, v = u.squeeze(0), v.squeeze(0)
+    if color_space == "RGB":  # a single matrix, stored without per-channel lists
+        original_sizes = original_sizes[0]
+        padded_sizes = padded_sizes[0] if patch else padded_sizes
 
-            factors = u.to(dtype), v.to(dtype)
+    if patch:
+        metadata["patch size"] = patch_size
+    if patch or color_space == "YCbCr":
+        metadata["original size"] = original_sizes
+    if patch:
+        metadata["padded size"] = padded_sizes
 
-        else:
-            x = image.float()
+    return matrices, metadata
 
-            if rank is None:
-                assert (
-                    quality >= 0 and quality <= 100
-                ), "'quality' must be between 0 and 100."
-                R = max(round(min(x.shape[-2:]) * quality / 100), 1)
-            else:
-                R = rank
 
-            metadata["rank"] = R
+def _packing_bounds(bounds: tuple[float, float]) -> tuple[int, int]:
+    """The integer range of the factors, for bit-packing."""
 
-            imf = IMF(rank=R, bounds=bounds, factor=(0, 1), **kwargs)
-            u, v, _ = imf.decompose(x.unsqueeze(0))
-            u, v = u.squeeze(0), v.squeeze(0)
+    assert None not in bounds, "Bit-packing requires finite 'bounds'."
+    low, high = math.ceil(bounds[0]), math.floor(bounds[1])
+    if not -(2**15) <= low <= high < 2**15:
+        # the bounds are stored as int16 in the tensor headers
+        raise ValueError(f"Bit-packing requires 'bounds' within int16, got {bounds}.")
+    return low, high
 
-            factors = u.to(dtype), v.to(dtype)
 
-    else:  # color_space == "YCbCr"
-        if not isinstance(rank, Iterable):
-            if rank is None:
-                rank = (None, None, None)
-            else:
-                rank = (rank, max(rank // 2, 1), max(rank // 2, 1))
+def _encode_metadata(
+    factors: list[torch.Tensor],
+    metadata: dict,
+    coder: str,
+    dictionary: Optional[int],
+    prediction: bool,
+) -> tuple[list[torch.Tensor], bytes]:
+    """Encode the metadata of an image, predicting its u factors if `prediction`."""
 
-        if not isinstance(quality, Iterable):
-            if quality is None:
-                quality = (None, None, None)
-            else:
-                quality = (quality, quality / 2, quality / 2)
+    if prediction:
+        factors, modes = dpcm_encode_factors(factors, metadata, coder, dictionary)
+        metadata = {**metadata, "prediction": modes}
 
-        image = image.float()
+    return factors, image_header_to_bytes(metadata, "imf")
 
-        ycbcr = rgb_to_ycbcr(image)
-        y, cb, cr = chroma_downsampling(ycbcr, scale_factor=scale_factor, mode="area")
 
-        if patch:
-            metadata["patch size"] = patch_size
-            metadata["original size"] = []
-            metadata["padded size"] = []
-            metadata["rank"] = []
-            factors = []
-            for i, channel in enumerate((y, cb, cr)):
-                x = pad_image(channel, patch_size, mode="reflect")
-                padded_size = x.shape[-2:]
+def _channel_sizes(metadata: dict, key: str) -> list[tuple[int, int]]:
+    """The original or padded size of each channel of an image."""
 
-                x = patchify(x, patch_size)
+    return [metadata[key]] if metadata["color space"] == "RGB" else metadata[key]
 
-                if rank[i] is None:
-                    assert (
-                        quality[i] >= 0 and quality[i] <= 100
-                    ), "'quality' must be between 0 and 100."
-                    R = max(round(min(x.shape[-2:]) * quality[i] / 100), 1)
-                else:
-                    R = rank[i]
 
-                metadata["original size"].append(channel.shape[-2:])
-                metadata["padded size"].append(padded_size)
-                metadata["rank"].append(R)
+def _block_rows(metadata: dict, block_rows: Optional[int]) -> Optional[list]:
+    """The number of rows per block of each factor, for `encode_layers`."""
 
-                imf = IMF(rank=R, bounds=bounds, factor=(0, 1), **kwargs)
-                u, v, _ = imf.decompose(x.unsqueeze(0))
-                u, v = u.squeeze(0), v.squeeze(0)
+    if block_rows is None:
+        return None
 
-                u, v = u.to(dtype), v.to(dtype)
+    q = metadata["patch size"][1]
+    return [
+        r
+        for _, w in _channel_sizes(metadata, "padded size")
+        for r in (block_rows * (w // q), None)
+    ]
 
-                factors.extend([u, v])
 
-        else:
-            metadata["original size"] = []
-            metadata["rank"] = []
-            factors = []
-            for i, channel in enumerate((y, cb, cr)):
-                if rank[i] is None:
-                    assert (
-                        quality[i] >= 0 and quality[i] <= 100
-                    ), "'quality' must be between 0 and 100."
-                    R = max(round(min(channel.shape[-2:]) * quality[i] / 100), 1)
-                else:
-                    R = rank[i]
+def _with_rank(metadata: dict, ranks: list[int]) -> dict:
+    """Add the channel ranks to the metadata of an image."""
+
+    rank = ranks[0] if metadata["color space"] == "RGB" else ranks
+    return {**metadata, "rank": rank}
+
+
+def imf_decode(
+    encoded_image: bytes,
+    integer: bool = False,
+    num_workers: int = 1,
+    max_rank: Optional[int | tuple[int, int, int]] = None,
+    max_bytes: Optional[int] = None,
+    roi: Optional[tuple[int, int, int, int]] = None,
+    scale: int = 1,
+    out: Optional[torch.Tensor] = None,
+    workspace: Optional[DecodeWorkspace] = None,
+) -> torch.Tensor:
+    """
+    Decode an IMF-compressed image.
 
-                metadata["original size"].append(channel.shape[-2:])
-                metadata["rank"].append(R)
+    Args:
+        encoded_image (bytes): The encoded image as a bytes-like object, e.g., from `load`.
+        integer (bool, optional): Whether to decode with integer arithmetic only, i.e.,
+            an int32 product of the integer factors, nearest-neighbor chroma upsampling
+            by indexing and a fixed-point color conversion straight to uint8. A
+            patch-encoded image is reconstructed strip by strip, so that the int32
+            values only exist in the strip buffers (default: False).
+        num_workers (int, optional): The number of threads that decompress the fibers of
+            the factors. With more than one, a patch-encoded image encoded with
+            `block_rows` or of at least `STRIP_DECODE_PIXELS` pixels is decompressed by
+            these threads while the calling thread reconstructs the strips that are
+            already decoded (see `reconstruct_image_pipelined`) (default: 1).
+        max_rank (int or tuple[int, int, int], optional): Reconstruct from only this many
+            leading components per channel, for a quick preview (default: None).
+        max_bytes (int, optional): Reconstruct from the layers within this many leading
+            bytes of `encoded_image`, e.g., of a partial download (default: None).
+        roi (tuple[int, int, int, int], optional): Only decode this region of interest
+            (top, left, height, width) of a patch-encoded image. It is reconstructed
+            from the patches covering it, and the u factors of images encoded with
+            `block_rows` are only decompressed where needed (default: None).
+        scale (int, optional): Decode a thumbnail downscaled by this factor, e.g., 2, 4
+            or 8, computed from the factors (see `downscale_factors`) rather than from the
+            full image. For a patch codec, it must divide the patch size (default: 1).
+        out (torch.Tensor or np.ndarray, optional): A preallocated output of shape
+            (C, H, W), possibly a strided view, e.g., of a channels-last frame buffer.
+            The decoded image is written into it (default: None).
+        workspace (DecodeWorkspace, optional): Scratch buffers reused across calls by
+            `reconstruct_image_into`. With `integer`, `out` or `workspace`, or from
+            `STRIP_DECODE_PIXELS` pixels on, a patch-encoded image is reconstructed strip
+            by strip (default: None).
 
-                imf = IMF(rank=R, bounds=bounds, factor=(0, 1), **kwargs)
-                u, v, _ = imf.decompose(channel.unsqueeze(0))
-                u, v = u.squeeze(0), v.squeeze(0)
+    Returns:
+        torch.Tensor: The decoded image tensor, i.e., `out` if given.
+    """
 
-                u, v = u.to(dtype), v.to(dtype)
+    encoded_metadata, encoded_layers = separate_layers(encoded_image, max_bytes)
+    metadata = bytes_to_image_header(encoded_metadata)
+
+    assert scale == 1 or (
+        not integer and roi is None
+    ), "'scale' is incompatible with 'integer' and 'roi'."
+
+    dtype = getattr(torch, metadata["dtype"])
+    assert (
+        out is None or torch.as_tensor(out).dtype == dtype
+    ), f"'out' must be of the dtype of the image, {dtype}."
+
+    if roi is not None and metadata["patch"]:
+        image = _decode_roi(encoded_layers, metadata, roi, integer, max_rank, num_workers)
+        return _write_out(to_dtype(image, dtype), out)
+
+    if (
+        metadata["patch"]
+        and not integer
+        and scale == 1
+        and num_workers > 1
+        and (_is_blocked(encoded_layers, metadata) or _is_large(metadata))
+    ):
+        image = reconstruct_image_pipelined(
+            encoded_layers,
+            metadata,
+            None if out is None else torch.as_tensor(out),
+            DecodeWorkspace() if workspace is None else workspace,
+            max_rank,
+            num_workers,
+        )
+        return image if out is None else out
 
-                factors.extend([u, v])
+    with worker_pool(num_workers) as executor:
+        factors = decode_layers(
+            encoded_layers, metadata["color space"], max_rank, executor=executor
+        )
+    factors = dpcm_decode_factors(factors, metadata)
+
+    if scale > 1:
+        patch_size = metadata["patch size"] if metadata["patch"] else None
+        factors = [
+            f
+            for u, v in zip(factors[::2], factors[1::2])
+            for f in downscale_factors(u.float(), v.float(), scale, patch_size)
+        ]
+        metadata = downscale_metadata(metadata, scale)
+
+    if metadata["patch"] and (
+        integer or out is not None or workspace is not None or _is_large(metadata)
+    ):
+        if out is None:
+            p, q = metadata["patch size"]
+            size = _channel_sizes(metadata, "original size")[0]
+            num_channels = len(factors[1]) // (p * q) if len(factors) == 2 else 3
+            out = torch.empty((num_channels, *size), dtype=dtype)
+        reconstruct_image_into(
+            [f.int() if integer else f.float() for f in factors],
+            metadata,
+            torch.as_tensor(out),
+            DecodeWorkspace() if workspace is None else workspace,
+            integer=integer,
+        )
+        return out
 
-    encoded_metadata = dict_to_bytes(metadata)
-    encoded_factors = combine_bytes([encode_tensor(factor) for factor in factors])
-    encoded_image = combine_bytes([encoded_metadata, encoded_factors])
+    image = _reconstruct_image(factors, metadata, integer)
 
-    return encoded_image
+    if roi is not None:  # without patches, the whole image is reconstructed anyway
+        top, left, height, width = roi
+        image = image[..., top : top + height, left : left + width]
 
+    if image.dtype != dtype:  # YCbCr with `integer` already yields uint8
+        image = to_dtype(image, dtype)
 
-def imf_decode(encoded_image: bytes) -> torch.Tensor:
+    return _write_out(image, out)
+
+
+def _is_large(metadata: dict) -> bool:
+    """Whether a patch-encoded image has at least `STRIP_DECODE_PIXELS` pixels."""
+
+    return math.prod(_channel_sizes(metadata, "original size")[0]) >= STRIP_DECODE_PIXELS
+
+
+def _is_blocked(encoded_layers: Sequence[bytes], metadata: dict) -> bool:
+    """Whether the u factors of an image were encoded with `block_rows`."""
+
+    num_factors = 2 if metadata["color space"] == "RGB" else 6
+    encoded_factors = separate_bytes(encoded_layers[0], num_factors)
+    return tensor_block_rows(encoded_factors[0]) is not None
+
+
+def _write_out(image: torch.Tensor, out: Optional[torch.Tensor]) -> torch.Tensor:
+    """Copy a decoded image into `out`, if given."""
+
+    if out is None:
+        return image
+
+    torch.as_tensor(out).copy_(image)
+    return out
+
+
+def imf_decode_batch(
+    encoded_images: Sequence[bytes], integer: bool = False, num_workers: int = 1
+) -> torch.Tensor | list[torch.Tensor]:
     """
-    Decode an IMF-compressed image.
+    Decode a batch of IMF-compressed images.
+
+    The bitstreams are grouped by their image size, patch layout and channel ranks.
+    The factors of each group are stacked, so that the reconstruction, color
+    conversion and upsampling run once per group rather than once per image.
 
     Args:
-        encoded_image (bytes): The encoded image in bytes.
+        encoded_images (Sequence[bytes]): The encoded images as bytes-like objects.
+        integer (bool, optional): Whether to decode with integer arithmetic only (see
+            `imf_decode`, default: False).
+        num_workers (int, optional): The number of threads that decompress the fibers of
+            the factors (default: 1).
 
     Returns:
-        torch.Tensor: The decoded image tensor.
+        torch.Tensor or list[torch.Tensor]: The decoded images, as a tensor of shape
+            (B, C, H, W) if they all have the same size, else as a list.
     """
 
-    encoded_metadata, encoded_factors = separate_bytes(encoded_image, 2)
-    metadata = bytes_to_dict(encoded_metadata)
+    groups = {}
+    with worker_pool(num_workers) as executor:
+        for b, encoded_image in enumerate(encoded_images):
+            encoded_metadata, encoded_layers = separate_layers(encoded_image)
+            metadata = bytes_to_image_header(encoded_metadata)
+            factors = decode_layers(
+                encoded_layers, metadata["color space"], executor=executor
+            )
+            factors = dpcm_decode_factors(factors, metadata)
+            metadata.pop("prediction", None)
+
+            key = (repr(metadata), *(f.shape for f in factors))
+            indices, _, stacks = groups.setdefault(key, ([], metadata, []))
+            indices.append(b)
+            stacks.append(factors)
+
+    images = [None] * len(encoded_images)
+    for indices, metadata, stacks in groups.values():
+        factors = [torch.stack(f) for f in zip(*stacks)]
+        batch = _reconstruct_image(factors, metadata, integer)
+        dtype = getattr(torch, metadata["dtype"])
+        if batch.dtype != dtype:  # YCbCr with `integer` already yields uint8
+            batch = to_dtype(batch, dtype)
+        if len(groups) == 1:
+            return batch
+
+        for j, b in enumerate(indices):
+            images[b] = batch[j]
+
+    if len({image.shape for image in images}) == 1:
+        return torch.stack(images)
+
+    return images
+
+
+def _reconstruct_image(
+    factors: Sequence[torch.Tensor], metadata: dict, integer: bool
+) -> torch.Tensor:
+    """Reconstruct an image, or a batch of same-size images, from its decoded factors."""
 
     if metadata["color space"] == "RGB":
-        encoded_u, encoded_v = separate_bytes(encoded_factors, 2)
-        u, v = decode_tensor(encoded_u), decode_tensor(encoded_v)
+        u, v = factors
 
-        u, v = u.float(), v.float()
+        u, v = (u.int(), v.int()) if integer else (u.float(), v.float())
         x = IMF.reconstruct(u, v)
 
         if metadata["patch"]:
@@ -321,15 +867,12 @@ def imf_decode(encoded_image: bytes) -> torch.Tensor:
             image = x
 
     else:  # color_space == "YCbCr"
-        encoded_factors = separate_bytes(encoded_factors, 6)
-        u_y, v_y = decode_tensor(encoded_factors[0]), decode_tensor(encoded_factors[1])
-        u_cb, v_cb = decode_tensor(encoded_factors[2]), decode_tensor(encoded_factors[3])
-        u_cr, v_cr = decode_tensor(encoded_factors[4]), decode_tensor(encoded_factors[5])
+        u_y, v_y, u_cb, v_cb, u_cr, v_cr = factors
 
         if metadata["patch"]:
             ycbcr = []
             for i, (u, v) in enumerate(((u_y, v_y), (u_cb, v_cb), (u_cr, v_cr))):
-                u, v = u.float(), v.float()
+                u, v = (u.int(), v.int()) if integer else (u.float(), v.float())
                 x = IMF.reconstruct(u, v)
                 channel = depatchify(
                     x, metadata["padded size"][i], metadata["patch size"]
@@ -339,15 +882,81 @@ def imf_decode(encoded_image: bytes) -> torch.Tensor:
         else:
             ycbcr = []
             for i, (u, v) in enumerate(((u_y, v_y), (u_cb, v_cb), (u_cr, v_cr))):
-                u, v = u.float(), v.float()
+                u, v = (u.int(), v.int()) if integer else (u.float(), v.float())
                 x = IMF.reconstruct(u, v)
                 ycbcr.append(x)
 
-        image = chroma_upsampling(
-            ycbcr, size=metadata["original size"][0], mode="nearest"
+        if integer:
+            image = chroma_upsampling_int(ycbcr, size=metadata["original size"][0])
+            image = ycbcr_to_rgb_int(image)
+        else:
+            image = chroma_upsampling(
+                ycbcr, size=metadata["original size"][0], mode="nearest"
+            )
+            image = ycbcr_to_rgb(image)
+
+    return image
+
+
+def _decode_roi(
+    encoded_layers: Sequence[bytes],
+    metadata: dict,
+    roi: tuple[int, int, int, int],
+    integer: bool,
+    max_rank: Optional[int | tuple[int, int, int]],
+    num_workers: int,
+) -> torch.Tensor:
+    """Decode a region of interest of a patch-encoded image from the patches covering it.
+
+    The pixels of each channel that the region needs are those that nearest-neighbor
+    chroma upsampling gathers (see `chroma_upsampling_int`), so the region equals the
+    same crop of the full image.
+    """
+
+    top, left, height, width = roi
+    p, q = metadata["patch size"]
+    original_sizes = _channel_sizes(metadata, "original size")
+    padded_sizes = _channel_sizes(metadata, "padded size")
+    H, W = original_sizes[0]
+    assert (
+        0 <= top < top + height <= H and 0 <= left < left + width <= W
+    ), "'roi' must be a non-empty region within the image."
+
+    windows, rows = [], []
+    for (h, w), (padded_h, padded_w) in zip(original_sizes, padded_sizes):
+        # the pixels of the channel in the region, in coordinates of the padded channel
+        ys = torch.arange(top, top + height) * h // H + (padded_h - h) // 2
+        xs = torch.arange(left, left + width) * w // W + (padded_w - w) // 2
+        i0, i1 = ys[0].item() // p, ys[-1].item() // p + 1
+        j0, j1 = xs[0].item() // q, xs[-1].item() // q + 1
+        # predicted u factors are decoded from the first row of patches on
+        start = 0 if "prediction" in metadata else i0
+        windows.append((ys - i0 * p, xs - j0 * q, i0 - start, i1 - start, j0, j1))
+        rows.extend([(start * (padded_w // q), i1 * (padded_w // q)), None])
+
+    with worker_pool(num_workers) as executor:
+        factors = decode_layers(
+            encoded_layers, metadata["color space"], max_rank, executor, rows
         )
-        image = ycbcr_to_rgb(image)
+    if "prediction" in metadata:
+        modes = metadata["prediction"]
+        modes = [modes] if metadata["color space"] == "RGB" else modes
+
+    channels = []
+    for c, (ys, xs, i0, i1, j0, j1) in enumerate(windows):
+        u, v = factors[2 * c], factors[2 * c + 1]
+        grid_w = padded_sizes[c][1] // q
+        if "prediction" in metadata:
+            u = dpcm_decode(u, (i1, grid_w), modes[c][: u.shape[-1]])
+        u = u.reshape(-1, grid_w, u.shape[-1])[i0:, j0:j1].flatten(0, 1)
+
+        u, v = (u.int(), v.int()) if integer else (u.float(), v.float())
+        x = IMF.reconstruct(u, v)
+        channel = depatchify(x, ((i1 - i0) * p, (j1 - j0) * q), (p, q))
+        channels.append(channel.index_select(-2, ys).index_select(-1, xs))
 
-    image = to_dtype(image, getattr(torch, metadata["dtype"]))
+    if metadata["color space"] == "RGB":
+        return channels[0]
 
-    return image
+    image = torch.cat(channels, dim=-3)
+    return ycbcr_to_rgb_int(image) if integer else ycbcr_to_rgb(image)
@@ -14,12 +14,19 @@ from lrf.compression.utils import (
     to_dtype,
     quantize,
     dequantize,
-    dict_to_bytes,
-    bytes_to_dict,
+    image_header_to_bytes,
+    bytes_to_image_header,
     combine_bytes,
-    separate_bytes,
-    encode_tensor,
-    decode_tensor,
+    separate_layers,
+    encode_layers,
+    decode_layers,
+    worker_pool,
+    dpcm_encode_factors,
+    dpcm_decode_factors,
+    downscale_factors,
+    downscale_metadata,
+    DecodeWorkspace,
+    reconstruct_image_into,
 )
 
 
@@ -123,6 +130,11 @@ def svd_encode(
     patch: bool = True,
     patch_size: tuple[int, int] = (8, 8),
     dtype: torch.dtype = None,
+    coder: str = "zlib",
+    num_workers: int = 1,
+    dictionary: Optional[int] = None,
+    prediction: bool = False,
+    layers: int = 1,
 ) -> Dict:
     """Compress an input image using SVD.
 
@@ -135,6 +147,11 @@ def svd_encode(
         patch (bool, optional): Whether to use patch-based encoding (default: True).
         patch_size (tuple[int, int], optional): The patch size (default: (8, 8)).
         dtype (Optional[torch.dtype], optional): The data type of the compressed image (default: None).
+        coder (str, optional): The entropy coder of the factors (see `entropy_encode`, default: 'zlib').
+        num_workers (int, optional): The number of threads that compress the fibers of the factors (default: 1).
+        dictionary (int, optional): The ID of a preset zlib dictionary for the factors (see `zlib_dictionary`, default: None).
+        prediction (bool, optional): Whether to code the u factors as DPCM residuals against the neighbor patches (see `dpcm_modes`). Requires `patch` and an integer `dtype` (default: False).
+        layers (int, optional): The number of rank-ordered layers of the factors (see `encode_layers`), for previews from a prefix of the bitstream (default: 1).
 
     Returns:
         bytes: The compressed image.
@@ -147,6 +164,13 @@ def svd_encode(
 
     dtype = image.dtype if dtype is None else dtype
 
+    assert not prediction or (
+        patch and not dtype.is_floating_point
+    ), "'prediction' requires 'patch' and an integer 'dtype'."
+    assert (
+        dictionary is None or coder.partition("-")[0] == "zlib"
+    ), "'dictionary' requires the 'zlib' coder."
+
     metadata = {
         "dtype": str(image.dtype).split(".")[-1],
         "color space": color_space,
@@ -223,15 +247,13 @@ def svd_encode(
 
                 x = patchify(x, patch_size)
 
-                metadata["padded size"].append(padded_size)
-
                 if rank[i] is None:
                     assert (
                         quality[i] >= 0 and quality[i] <= 100
                     ), "'quality' must be between 0 and 100."
                     R = max(round(min(x.shape[-2:]) * quality[i] / 100), 1)
                 else:
-                    R = rank
+                    R = rank[i]
 
                 metadata["original size"].append(channel.shape[-2:])
                 metadata["padded size"].append(padded_size)
@@ -286,76 +308,123 @@ def svd_encode(
 
                 factors.extend([u, v])
 
-    encoded_metadata = dict_to_bytes(metadata)
-    encoded_factors = combine_bytes([encode_tensor(factor) for factor in factors])
+    if prediction:
+        factors, metadata["prediction"] = dpcm_encode_factors(
+            factors, metadata, coder, dictionary
+        )
+
+    encoded_metadata = image_header_to_bytes(metadata, "svd")
+    with worker_pool(num_workers) as executor:
+        encoded_layers = encode_layers(
+            factors, layers, coder=coder, executor=executor, dictionary=dictionary
+        )
 
-    encoded_image = combine_bytes([encoded_metadata, encoded_factors])
+    encoded_image = combine_bytes([encoded_metadata, *encoded_layers])
 
     return encoded_image
 
 
-def svd_decode(encoded_image: bytes) -> torch.Tensor:
+def svd_decode(
+    encoded_image: bytes,
+    num_workers: int = 1,
+    max_rank: Optional[int | tuple[int, int, int]] = None,
+    max_bytes: Optional[int] = None,
+    scale: int = 1,
+    out: Optional[torch.Tensor] = None,
+    workspace: Optional[DecodeWorkspace] = None,
+) -> torch.Tensor:
     """Decompress an SVD-encoded image.
 
     Args:
-        encoded_image (bytes): The encoded image data.
+        encoded_image (bytes): The encoded image data, as a bytes-like object (e.g., from `load`).
+        num_workers (int, optional): The number of threads that decompress the fibers of the factors (default: 1).
+        max_rank (int or tuple[int, int, int], optional): Reconstruct from only this many leading components per channel (default: None).
+        max_bytes (int, optional): Reconstruct from the layers within this many leading bytes of `encoded_image`, e.g., of a partial download (default: None).
+        scale (int, optional): Decode a thumbnail downscaled by this factor, computed from the factors (see `downscale_factors`). For a patch codec, it must divide the patch size (default: 1).
+        out (torch.Tensor or np.ndarray, optional): A preallocated output of shape (C, H, W) and of the dtype of the image, into which it is written (default: None).
+        workspace (DecodeWorkspace, optional): Scratch buffers reused across calls, see `reconstruct_image_into` (default: None).
 
     Returns:
-        torch.Tensor: The decompressed image tensor.
+        torch.Tensor: The decompressed image tensor, i.e., `out` if given.
     """
 
-    encoded_metadata, encoded_factors = separate_bytes(encoded_image, 2)
-    metadata = bytes_to_dict(encoded_metadata)
-
+    encoded_metadata, encoded_layers = separate_layers(encoded_image, max_bytes)
+    metadata = bytes_to_image_header(encoded_metadata)
+    with worker_pool(num_workers) as executor:
+        factors = decode_layers(
+            encoded_layers, metadata["color space"], max_rank, executor=executor
+        )
+    factors = dpcm_decode_factors(factors, metadata)
+    patch_size = metadata["patch size"] if metadata["patch"] else None
+    sizes = metadata if scale == 1 else downscale_metadata(metadata, scale)
+    dtype = getattr(torch, metadata["dtype"])
+    assert (
+        out is None or torch.as_tensor(out).dtype == dtype
+    ), f"'out' must be of the dtype of the image, {dtype}."
+
+    qtz = metadata["quantization"]
     if metadata["color space"] == "RGB":
-        encoded_u, encoded_v = separate_bytes(encoded_factors, 2)
-        u, v = decode_tensor(encoded_u), decode_tensor(encoded_v)
-
-        qtz = metadata["quantization"]
+        qtz_u, qtz_v = [qtz["u"]], [qtz["v"]]
+    else:
         qtz_u, qtz_v = qtz["u"], qtz["v"]
 
-        u = u if qtz_u is None else dequantize(u, *qtz_u)
-        v = v if qtz_v is None else dequantize(v, *qtz_v)
+    channel_factors = []
+    for i, (u, v) in enumerate(zip(factors[::2], factors[1::2])):
+        u = u if qtz_u[i] is None else dequantize(u, *qtz_u[i])
+        v = v if qtz_v[i] is None else dequantize(v, *qtz_v[i])
+        if scale > 1:
+            u, v = downscale_factors(u, v, scale, patch_size)
+        channel_factors.extend([u, v])
+
+    if (out is not None or workspace is not None) and metadata["patch"]:
+        if out is None:
+            p, q = sizes["patch size"]
+            size = (
+                sizes["original size"] if len(factors) == 2 else sizes["original size"][0]
+            )
+            num_channels = len(factors[1]) // (p * q) if len(factors) == 2 else 3
+            out = torch.empty((num_channels, *size), dtype=dtype)
+        reconstruct_image_into(
+            [f.float() for f in channel_factors],
+            sizes,
+            torch.as_tensor(out),
+            DecodeWorkspace() if workspace is None else workspace,
+            mode="area",
+        )
+        return out
+
+    if metadata["color space"] == "RGB":
+        u, v = channel_factors
 
         x = u @ v.mT
 
         if metadata["patch"]:
-            image = depatchify(x, metadata["padded size"], metadata["patch size"])
-            image = unpad_image(image, metadata["original size"])
+            image = depatchify(x, sizes["padded size"], sizes["patch size"])
+            image = unpad_image(image, sizes["original size"])
         else:
             image = x
 
     else:
-        encoded_factors = separate_bytes(encoded_factors, 6)
-
-        u_y, v_y = decode_tensor(encoded_factors[0]), decode_tensor(encoded_factors[1])
-        u_cb, v_cb = decode_tensor(encoded_factors[2]), decode_tensor(encoded_factors[3])
-        u_cr, v_cr = decode_tensor(encoded_factors[4]), decode_tensor(encoded_factors[5])
-
         ycbcr = []
-        for i, (u, v) in enumerate(((u_y, v_y), (u_cb, v_cb), (u_cr, v_cr))):
-
-            qtz = metadata["quantization"]
-            qtz_u, qtz_v = qtz["u"][i], qtz["v"][i]
-
-            u = u if qtz_u is None else dequantize(u, *qtz_u)
-            v = v if qtz_v is None else dequantize(v, *qtz_v)
+        for i, (u, v) in enumerate(zip(channel_factors[::2], channel_factors[1::2])):
 
             x = u @ v.mT
 
             if metadata["patch"]:
-                channel = depatchify(
-                    x, metadata["padded size"][i], metadata["patch size"]
-                )
-                channel = unpad_image(channel, metadata["original size"][i])
+                channel = depatchify(x, sizes["padded size"][i], sizes["patch size"])
+                channel = unpad_image(channel, sizes["original size"][i])
             else:
                 channel = x
 
             ycbcr.append(channel)
 
-        image = chroma_upsampling(ycbcr, size=metadata["original size"][0], mode="area")
+        image = chroma_upsampling(ycbcr, size=sizes["original size"][0], mode="area")
         image = ycbcr_to_rgb(image)
 
-    image = to_dtype(image, getattr(torch, metadata["dtype"]))
+    image = to_dtype(image, dtype)
+
+    if out is not None:
+        torch.as_tensor(out).copy_(image)
+        return out
 
     return image
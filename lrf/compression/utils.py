@@ -1,7 +1,15 @@
-from typing import Sequence, Any
+from typing import Any, Callable, Optional, Sequence
+import bz2
+from concurrent.futures import Executor, ThreadPoolExecutor
+import contextlib
 import functools
+import lzma
 from operator import mul
 import json
+import math
+import mmap
+import os
+import struct
 import zlib
 
 import torch
@@ -25,10 +33,10 @@ def rgb_to_ycbcr(rgb_img: torch.Tensor) -> torch.Tensor:
     """Convert an RGB image to YCbCr color space.
 
     Args:
-        rgb_img (torch.Tensor): Input RGB image of shape (3, H, W).
+        rgb_img (torch.Tensor): Input RGB image of shape (..., 3, H, W).
 
     Returns:
-        torch.Tensor: YCbCr image of shape (3, H, W).
+        torch.Tensor: YCbCr image of shape (..., 3, H, W).
     """
     # Transformation matrix from RGB to YCbCr
     transform_matrix = torch.tensor(
@@ -41,7 +49,7 @@ def rgb_to_ycbcr(rgb_img: torch.Tensor) -> torch.Tensor:
 
     # Apply the transformation
     ycbcr_img = offset + torch.einsum(
-        "ij, j... -> i...", transform_matrix, rgb_img.float()
+        "ij, ...jhw -> ...ihw", transform_matrix, rgb_img.float()
     )
 
     return ycbcr_img
@@ -51,10 +59,10 @@ def ycbcr_to_rgb(ycbcr_img: torch.Tensor) -> torch.Tensor:
     """Convert a YCbCr image to RGB color space.
 
     Args:
-        ycbcr_img (torch.Tensor): Input YCbCr image of shape (3, H, W).
+        ycbcr_img (torch.Tensor): Input YCbCr image of shape (..., 3, H, W).
 
     Returns:
-        torch.Tensor: RGB image of shape (3, H, W).
+        torch.Tensor: RGB image of shape (..., 3, H, W).
     """
     # Transformation matrix from YCbCr to RGB
     transform_matrix = torch.tensor(
@@ -67,19 +75,71 @@ def ycbcr_to_rgb(ycbcr_img: torch.Tensor) -> torch.Tensor:
 
     # Apply the transformation
     rgb_img = torch.einsum(
-        "ij, j... -> i...", transform_matrix, ycbcr_img.float() + offset
+        "ij, ...jhw -> ...ihw", transform_matrix, ycbcr_img.float() + offset
     )
 
     return rgb_img
 
 
+def ycbcr_to_rgb_int(ycbcr_img: torch.Tensor, frac_bits: int = 16) -> torch.Tensor:
+    """Convert an integer YCbCr image to an RGB uint8 image with fixed-point arithmetic.
+
+    Computes the same transform as `ycbcr_to_rgb`, followed by clamping and truncation
+    to uint8, using int32 arithmetic only. The inputs are clamped to [-8192, 8191]
+    first, so that no intermediate overflows int32.
+
+    Args:
+        ycbcr_img (torch.Tensor): Input YCbCr image of shape (..., 3, H, W), of an integer dtype.
+        frac_bits (int, optional): The number of fractional bits of the fixed-point
+            coefficients (default: 16).
+
+    Returns:
+        torch.Tensor: RGB image of shape (..., 3, H, W) and dtype uint8.
+    """
+
+    ycbcr_img = ycbcr_img.to(torch.int32, copy=True)
+    rgb_img = torch.empty_like(ycbcr_img)
+    _ycbcr_to_rgb_int_(ycbcr_img, rgb_img, frac_bits)
+    return rgb_img.to(torch.uint8)
+
+
+def _ycbcr_to_rgb_int_(
+    ycbcr_img: torch.Tensor, rgb_img: torch.Tensor, frac_bits: int = 16
+) -> torch.Tensor:
+    """`ycbcr_to_rgb_int` from and into int32 tensors, overwriting `ycbcr_img`."""
+
+    def fixed(c: float) -> int:
+        return round(c * (1 << frac_bits))
+
+    y, cb, cr = ycbcr_img.clamp_(-8192, 8191).unbind(dim=-3)
+    r, g, b = rgb_img.unbind(dim=-3)
+    y <<= frac_bits
+    cb -= 128
+    cr -= 128
+
+    torch.mul(cr, fixed(1.40200), out=r).add_(y)
+    torch.mul(cb, -fixed(0.344136), out=g).add_(cr, alpha=-fixed(0.714136)).add_(y)
+    torch.mul(cb, fixed(1.77200), out=b).add_(y)
+
+    # arithmetic right shift floors, like the truncation of clamped values in `to_dtype`
+    rgb_img >>= frac_bits
+    return rgb_img.clamp_(0, 255)
+
+
+def _interpolate(x: torch.Tensor, **kwargs) -> torch.Tensor:
+    """Apply `torch.nn.functional.interpolate` to a tensor of shape (..., C, H, W)."""
+
+    y = F.interpolate(x.reshape(-1, *x.shape[-3:]), **kwargs)
+    return y.reshape(*x.shape[:-2], *y.shape[-2:])
+
+
 def chroma_downsampling(
     img_ycbcr: torch.Tensor, **kwargs
 ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
     """Downsample the chroma channels (Cb and Cr) of a YCbCr image.
 
     Args:
-        img_ycbcr (torch.Tensor): Input YCbCr image of shape (C, H, W).
+        img_ycbcr (torch.Tensor): Input YCbCr image of shape (..., C, H, W).
         **kwargs: Additional arguments for `torch.nn.functional.interpolate`.
 
     Returns:
@@ -87,21 +147,48 @@ def chroma_downsampling(
     """
 
     # Luminance channel (Y) remains unchanged
-    Y = img_ycbcr[0:1, :, :]
+    Y = img_ycbcr[..., 0:1, :, :]
     # Downsample Cb channel
-    Cb = F.interpolate(img_ycbcr[None, 1:2, :, :], **kwargs).squeeze(0)
+    Cb = _interpolate(img_ycbcr[..., 1:2, :, :], **kwargs)
     # Downsample Cr channel
-    Cr = F.interpolate(img_ycbcr[None, 2:3, :, :], **kwargs).squeeze(0)
+    Cr = _interpolate(img_ycbcr[..., 2:3, :, :], **kwargs)
     return Y, Cb, Cr
 
 
 def chroma_upsampling(ycbcr, **kwargs):
     Y, Cb, Cr = ycbcr
     # Upsample Cb channel
-    Cb = F.interpolate(Cb[None, :, :], **kwargs).squeeze(0)
+    Cb = _interpolate(Cb, **kwargs)
     # Upsample Cr channel
-    Cr = F.interpolate(Cr[None, :, :], **kwargs).squeeze(0)
-    img_ycbcr = torch.cat((Y, Cb, Cr), dim=0)
+    Cr = _interpolate(Cr, **kwargs)
+    img_ycbcr = torch.cat((Y, Cb, Cr), dim=-3)
+    return img_ycbcr
+
+
+def chroma_upsampling_int(
+    ycbcr: Sequence[torch.Tensor], size: tuple[int, int]
+) -> torch.Tensor:
+    """Upsample the chroma channels (Cb and Cr) by nearest neighbor, for any dtype.
+
+    Unlike `chroma_upsampling`, this works on integer tensors, since it only gathers
+    rows and columns (source index = floor(target index * input size / output size)).
+
+    Args:
+        ycbcr (Sequence[torch.Tensor]): The Y, Cb, and Cr channels, each of shape (..., 1, h, w).
+        size (tuple[int, int]): The output size (H, W).
+
+    Returns:
+        torch.Tensor: The YCbCr image of shape (..., 3, H, W).
+    """
+
+    Y, Cb, Cr = ycbcr
+    H, W = size
+    h, w = Cb.shape[-2:]
+    rows = torch.arange(H, device=Cb.device) * h // H
+    cols = torch.arange(W, device=Cb.device) * w // W
+    Cb = Cb.index_select(-2, rows).index_select(-1, cols)
+    Cr = Cr.index_select(-2, rows).index_select(-1, cols)
+    img_ycbcr = torch.cat((Y, Cb, Cr), dim=-3)
     return img_ycbcr
 
 
@@ -111,7 +198,7 @@ def pad_image(
     """Pad an image tensor to ensure it can be evenly divided into patches of size (P, Q).
 
     Args:
-        img (torch.Tensor): The input image tensor of shape (C, H, W).
+        img (torch.Tensor): The input image tensor of shape (..., C, H, W).
         patch_size (tuple[int, int]): The height (P) and width (Q) of each patch.
         *args: Additional arguments for `torch.nn.functional.pad`.
         **kwargs: Additional keyword arguments for `torch.nn.functional.pad`.
@@ -120,7 +207,7 @@ def pad_image(
         Tensor: The padded image tensor.
     """
 
-    _, H, W = img.shape
+    H, W = img.shape[-2:]
     P, Q = patch_size
     pad_height = (P - H % P) % P
     pad_width = (Q - W % Q) % Q
@@ -136,20 +223,20 @@ def unpad_image(padded_img: torch.Tensor, orig_size: tuple[int, int]) -> torch.T
     """Recover the original image from a padded image by removing the added padding.
 
     Args:
-        padded_img (torch.Tensor): The padded image tensor of shape (C, H', W').
+        padded_img (torch.Tensor): The padded image tensor of shape (..., C, H', W').
         orig_size (tuple[int, int]): The original size of the image before padding (H_orig, W_orig).
 
     Returns:
-        torch.Tensor: The original image tensor of shape (C, H_orig, W_orig).
+        torch.Tensor: The original image tensor of shape (..., C, H_orig, W_orig).
     """
 
-    _, H_padded, W_padded = padded_img.shape
+    H_padded, W_padded = padded_img.shape[-2:]
     H_orig, W_orig = orig_size
     start_h = (H_padded - H_orig) // 2
     end_h = start_h + H_orig
     start_w = (W_padded - W_orig) // 2
     end_w = start_w + W_orig
-    original_img = padded_img[:, start_h:end_h, start_w:end_w]
+    original_img = padded_img[..., start_h:end_h, start_w:end_w]
     return original_img
 
 
@@ -182,6 +269,178 @@ def to_dtype(tensor: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
     return clamped_tensor
 
 
+class DecodeWorkspace:
+    """Scratch buffers that the decoders reuse across calls.
+
+    In a loop that decodes many images of the same size, passing the same workspace to
+    `imf_decode` or `svd_decode` makes every call write its intermediate products into
+    the buffers of the previous one, so nothing is allocated in the steady state. Each
+    buffer only ever grows, to the largest size requested so far.
+    """
+
+    def __init__(self) -> None:
+        self.buffers = {}
+        self.indices = {}
+
+    def buffer(
+        self, name: str, shape: Sequence[int], dtype: torch.dtype = torch.float32
+    ) -> torch.Tensor:
+        """Get a contiguous scratch tensor of the given shape, with arbitrary contents.
+
+        Args:
+            name (str): The name of the buffer.
+            shape (Sequence[int]): The shape of the tensor.
+            dtype (torch.dtype, optional): The dtype of the tensor (default: torch.float32).
+
+        Returns:
+            torch.Tensor: A view of the buffer.
+        """
+
+        numel = prod(shape)
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.numel() < numel:
+            buffer = torch.empty(numel, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer[:numel].view(*shape)
+
+    def nearest_index(
+        self, in_size: int, out_size: int, integer: bool = False
+    ) -> torch.Tensor:
+        """The source indices of nearest-neighbor upsampling from `in_size` to
+        `out_size`, exactly as `torch.nn.functional.interpolate` computes them, or with
+        `integer`, as `chroma_upsampling_int` does."""
+
+        key = (in_size, out_size, integer)
+        if key not in self.indices:
+            if integer:
+                index = torch.arange(out_size) * in_size // out_size
+            else:
+                index = torch.arange(in_size, dtype=torch.float32).view(1, 1, -1)
+                index = F.interpolate(index, size=out_size, mode="nearest").view(-1)
+            self.indices[key] = index.long()
+        return self.indices[key]
+
+
+def reconstruct_image_into(
+    factors: Sequence[torch.Tensor],
+    metadata: dict,
+    out: torch.Tensor,
+    workspace: DecodeWorkspace,
+    mode: str = "nearest",
+    strip_height: Optional[int] = 64,
+    rows: Optional[tuple[int, int]] = None,
+    integer: bool = False,
+) -> torch.Tensor:
+    """Reconstruct a patch-encoded image from its float factors into an output tensor.
+
+    Computes the same as the decoders, i.e., the product of the factors of each channel,
+    depatchify, unpad, chroma upsampling, color conversion and clamping, but fused over
+    strips of output rows: each strip is carried through all stages in small buffers of
+    `workspace`, while it is still in cache, and then written into `out`. A strip needs
+    the rows of patches of each channel that cover it, whose products are computed from
+    the corresponding rows of u only.
+
+    With `integer`, the strips are computed as in the integer decode of `imf_decode`,
+    i.e., from int32 products, with `chroma_upsampling_int` and `ycbcr_to_rgb_int`, so
+    that int32 values only exist in the strip buffers.
+
+    Args:
+        factors (Sequence[torch.Tensor]): The float factors (u, v) of each channel, or
+            the int32 factors with `integer`.
+        metadata (dict): The metadata of the image (see `image_header_to_bytes`).
+        out (torch.Tensor): The output tensor of shape (C, H, W), possibly a strided
+            view, e.g., of a channels-last frame buffer.
+        workspace (DecodeWorkspace): The workspace.
+        mode (str, optional): The chroma upsampling mode, 'nearest' or 'area'
+            (default: 'nearest').
+        strip_height (int, optional): The number of output rows per strip, or None for a
+            single strip (default: 64).
+        rows (tuple[int, int], optional): Only reconstruct the rows [start, stop) of the
+            image, from the factor rows that cover them, or None for all rows
+            (default: None).
+        integer (bool, optional): Whether to use integer arithmetic only, which requires
+            the 'nearest' mode (default: False).
+
+    Returns:
+        torch.Tensor: `out`.
+    """
+
+    assert not integer or mode == "nearest", "'integer' requires the 'nearest' mode."
+
+    color_space = metadata["color space"]
+    p, q = metadata["patch size"]
+    original_sizes = _per_channel(metadata["original size"], color_space)
+    padded_sizes = _per_channel(metadata["padded size"], color_space)
+    H, W = original_sizes[0]
+
+    # area upsampling by an integer factor repeats pixels, like nearest; other factors
+    # average over neighbor pixels and are upsampled from the whole channel
+    nearest = mode == "nearest" or all(
+        H % h == 0 and W % w == 0 for h, w in original_sizes
+    )
+    strip_height = H if strip_height is None or not nearest else strip_height
+    start, stop = (0, H) if rows is None else rows
+    assert nearest or (start, stop) == (0, H), "Area upsampling needs all rows."
+
+    dtype = torch.int32 if integer else torch.float32
+    for top in range(start, stop, strip_height):
+        bottom = min(top + strip_height, stop)
+        strip = workspace.buffer("strip", (len(out), bottom - top, W), dtype)
+
+        for c, (h, w) in enumerate(original_sizes):
+            u, v = factors[2 * c], factors[2 * c + 1]
+            padded_h, padded_w = padded_sizes[c]
+            offset_h, offset_w = (padded_h - h) // 2, (padded_w - w) // 2
+            grid_w, num_channels = padded_w // q, v.shape[0] // (p * q)
+
+            # the rows of the channel in the strip, and the rows of patches covering them
+            if c == 0 or not nearest:
+                ys = torch.arange(top, bottom) if nearest else torch.arange(h)
+            else:
+                ys = workspace.nearest_index(h, H, integer)[top:bottom]
+            y0, y1 = ys[0].item() + offset_h, ys[-1].item() + offset_h + 1
+            i0, i1 = y0 // p, -(-y1 // p)
+
+            x = workspace.buffer(f"product{c}", ((i1 - i0) * grid_w, v.shape[0]), dtype)
+            torch.matmul(u[i0 * grid_w : i1 * grid_w], v.mT, out=x)
+            patches = workspace.buffer(
+                f"patches{c}", (num_channels, (i1 - i0) * p, padded_w), dtype
+            )
+            patches.view(num_channels, i1 - i0, p, grid_w, q).copy_(
+                x.view(i1 - i0, grid_w, num_channels, p, q).permute(2, 0, 3, 1, 4)
+            )
+            channel = patches[:, y0 - i0 * p : y1 - i0 * p, offset_w : offset_w + w]
+
+            if c == 0 and nearest:
+                strip[: len(channel)].copy_(channel)
+            elif not nearest:
+                strip[c : c + 1].copy_(_interpolate(channel, size=(H, W), mode=mode))
+            else:
+                upsampled_rows = workspace.buffer(f"rows{c}", (1, bottom - top, w), dtype)
+                torch.index_select(channel, -2, ys - ys[0], out=upsampled_rows)
+                cols = workspace.nearest_index(w, W, integer)
+                torch.index_select(upsampled_rows, -1, cols, out=strip[c : c + 1])
+
+        if color_space == "YCbCr" and integer:
+            rgb = workspace.buffer("rgb", strip.shape, torch.int32)
+            strip = _ycbcr_to_rgb_int_(strip, rgb)
+        elif color_space == "YCbCr":
+            transform_matrix = torch.tensor(
+                [[1.0, 0.0, 1.40200], [1.0, -0.344136, -0.714136], [1.0, 1.77200, 0.0]]
+            )
+            strip[1:] -= 128
+            rgb = workspace.buffer("rgb", strip.shape)
+            torch.matmul(transform_matrix, strip.view(3, -1), out=rgb.view(3, -1))
+            strip = rgb
+
+        if not out.dtype.is_floating_point:
+            info = torch.iinfo(out.dtype)
+            strip.clamp_(info.min, info.max)
+        out[:, top:bottom].copy_(strip)
+
+    return out
+
+
 def quantize(
     tensor: torch.Tensor, target_dtype: torch.dtype
 ) -> tuple[torch.Tensor, float, float]:
@@ -234,15 +493,207 @@ def dequantize(
         Tensor: Dequantized tensor.
     """
 
+    # The smallest quantized value; a subset of the entries (e.g., the leading components
+    # of a factor) need not contain it
+    if quantized_tensor.dtype.is_floating_point:
+        qmin = quantized_tensor.min()
+    else:
+        qmin = torch.iinfo(quantized_tensor.dtype).min
+
     # Convert to float32 for calculation
     quantized_tensor = quantized_tensor.to(torch.float32)
 
     # Dequantize
-    dequantized = (quantized_tensor - quantized_tensor.min()) * scale + min_val
+    dequantized = (quantized_tensor - qmin) * scale + min_val
 
     return dequantized
 
 
+def _area_rows(x: torch.Tensor, scale: int) -> torch.Tensor:
+    """Average the rows of a tensor of shape (..., n, r) over windows of about `scale`
+    rows, like `interpolate` with mode 'area'."""
+
+    n, r = x.shape[-2:]
+    y = F.adaptive_avg_pool1d(x.mT.reshape(-1, 1, n), math.ceil(n / scale))
+    return y.reshape(*x.shape[:-2], r, -1).mT
+
+
+def downscale_factors(
+    u: torch.Tensor,
+    v: torch.Tensor,
+    scale: int,
+    patch_size: Optional[tuple[int, int]] = None,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Downscale the image reconstructed from float factors by area averaging.
+
+    Averaging is linear, so it can be applied to the factors instead of the image. For a
+    patch codec, averaging the v factor over scale x scale pixel cells of a patch yields
+    the patches of the downscaled image, at the cost of a matrix product with scale**2
+    times fewer columns; e.g., with `scale` equal to the patch size, each patch becomes
+    the pixel u_row · mean(v). Otherwise, the rows of both factors are averaged.
+
+    Args:
+        u (torch.Tensor): The u factor.
+        v (torch.Tensor): The v factor.
+        scale (int): The downscaling factor, which must divide the patch size if any.
+        patch_size (tuple[int, int], optional): The patch size of a patch codec, whose
+            rows of v are the flattened (channel, p, q) patch entries (default: None).
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor]: The factors of the downscaled image, whose
+            patches (if any) are of size (p / scale, q / scale).
+    """
+
+    if patch_size is None:
+        return _area_rows(u, scale), _area_rows(v, scale)
+
+    p, q = patch_size
+    assert p % scale == 0 and q % scale == 0, "'scale' must divide the patch size."
+    rank = v.shape[-1]
+    v = v.mT.reshape(rank, -1, p, q)
+    v = F.avg_pool2d(v, scale).reshape(rank, -1).mT
+    return u, v
+
+
+def downscale_metadata(metadata: dict, scale: int) -> dict:
+    """The metadata of an encoded image (see `image_header_to_bytes`) after downscaling
+    its factors with `downscale_factors`.
+
+    Args:
+        metadata (dict): The metadata.
+        scale (int): The downscaling factor.
+
+    Returns:
+        dict: The metadata with the patch and image sizes of the downscaled image.
+    """
+
+    color_space = metadata["color space"]
+    metadata = dict(metadata)
+    if "patch size" in metadata:
+        metadata["patch size"] = [s // scale for s in metadata["patch size"]]
+    if "padded size" in metadata:
+        padded_sizes = _per_channel(metadata["padded size"], color_space)
+        metadata["padded size"] = _from_channels(
+            [[s // scale for s in size] for size in padded_sizes], color_space
+        )
+    if "original size" in metadata:
+        original_sizes = _per_channel(metadata["original size"], color_space)
+        metadata["original size"] = _from_channels(
+            [[math.ceil(s / scale) for s in size] for size in original_sizes],
+            color_space,
+        )
+
+    return metadata
+
+
+# DPCM predictors of the rows of a factor matrix laid out on a grid
+PREDICTION_MODES = ("none", "left", "top", "gradient")
+
+
+def _dpcm_residuals(grid: torch.Tensor) -> torch.Tensor:
+    """The residuals of an int64 grid of shape (h, w, r) under every prediction mode,
+    stacked along a last dimension in the order of `PREDICTION_MODES`."""
+
+    left = grid.clone()
+    left[:, 1:] -= grid[:, :-1]
+    top = grid.clone()
+    top[1:] -= grid[:-1]
+    gradient = left.clone()
+    gradient[1:] -= left[:-1]
+    return torch.stack((grid, left, top, gradient), dim=-1)
+
+
+def dpcm_encode(
+    matrix: torch.Tensor, grid_size: tuple[int, int], modes: Sequence[str]
+) -> torch.Tensor:
+    """Replace the entries of an integer matrix by their prediction residuals.
+
+    The rows of the matrix are the cells of a grid in row-major order, e.g., the rows of
+    the u factor of a patchified image are its patches. Each column is predicted from
+    the same column of the left neighbor ('left'), the top neighbor ('top'), or both
+    ('gradient', i.e., left + top - top-left), or not at all ('none'). The arithmetic
+    wraps around in the dtype of the matrix, so the residuals have the same dtype and
+    `dpcm_decode` restores the matrix exactly.
+
+    Args:
+        matrix (torch.Tensor): The integer matrix of shape (h * w, r).
+        grid_size (tuple[int, int]): The size of the grid (h, w).
+        modes (Sequence[str]): The prediction mode of each column (see `PREDICTION_MODES`).
+
+    Returns:
+        torch.Tensor: The residuals.
+    """
+
+    assert not matrix.dtype.is_floating_point, "DPCM requires an integer matrix."
+
+    grid = matrix.reshape(*grid_size, -1).long()
+    index = torch.tensor([PREDICTION_MODES.index(m) for m in modes])
+    residuals = _dpcm_residuals(grid)[:, :, torch.arange(len(modes)), index]
+    return residuals.reshape(matrix.shape).to(matrix.dtype)
+
+
+def dpcm_decode(
+    residuals: torch.Tensor, grid_size: tuple[int, int], modes: Sequence[str]
+) -> torch.Tensor:
+    """Invert `dpcm_encode`.
+
+    Args:
+        residuals (torch.Tensor): The residuals of shape (h * w, r).
+        grid_size (tuple[int, int]): The size of the grid (h, w).
+        modes (Sequence[str]): The prediction mode of each column.
+
+    Returns:
+        torch.Tensor: The matrix.
+    """
+
+    grid = residuals.reshape(*grid_size, -1).long()
+    for mode, dims in (("left", (1,)), ("top", (0,)), ("gradient", (0, 1))):
+        columns = [j for j, m in enumerate(modes) if m == mode]
+        if columns:
+            x = grid[:, :, columns]
+            for dim in dims:
+                x = x.cumsum(dim)
+            grid[:, :, columns] = x
+
+    return grid.reshape(residuals.shape).to(residuals.dtype)
+
+
+def dpcm_modes(
+    matrix: torch.Tensor,
+    grid_size: tuple[int, int],
+    coder: str = "zlib",
+    dictionary: Optional[int] = None,
+) -> list[str]:
+    """Choose the prediction mode of each column of a matrix for `dpcm_encode`.
+
+    Every column is compressed under every mode, as a fiber of `encode_matrix` would be,
+    and the mode with the fewest bytes wins. Smooth maps such as the first components of
+    an image favor prediction, noisy ones 'none'.
+
+    Args:
+        matrix (torch.Tensor): The integer matrix of shape (h * w, r).
+        grid_size (tuple[int, int]): The size of the grid (h, w).
+        coder (str, optional): The entropy coder, see `entropy_encode` (default: 'zlib').
+        dictionary (int, optional): The ID of a preset zlib dictionary (default: None).
+
+    Returns:
+        list[str]: The prediction mode of each column.
+    """
+
+    grid = matrix.reshape(*grid_size, -1).long()
+    residuals = _dpcm_residuals(grid).to(matrix.dtype).flatten(0, 1).numpy()
+    num_columns, num_modes = residuals.shape[1:]
+    fibers = [
+        np.ascontiguousarray(residuals[:, j, k]).tobytes()
+        for j in range(num_columns)
+        for k in range(num_modes)
+    ]
+    zdict = None if dictionary is None else zlib_dictionary(dictionary)
+    sizes = np.array([len(f) for f in entropy_encode(fibers, coder, zdict=zdict)])
+    best = sizes.reshape(num_columns, num_modes).argmin(axis=1)
+    return [PREDICTION_MODES[k] for k in best]
+
+
 def _combine_bytes(payload1: bytes, payload2: bytes) -> bytes:
     """Encode two bytes objects into a single bytes object.
 
@@ -275,8 +726,8 @@ def _separate_bytes(combined: bytes) -> tuple[bytes, bytes]:
         tuple[bytes, bytes]: The two original bytes objects (payload1, payload2).
     """
 
-    if not isinstance(combined, bytes):
-        raise TypeError("Combined must be a bytes object.")
+    if not isinstance(combined, (bytes, bytearray, memoryview)):
+        raise TypeError("Combined must be a bytes-like object.")
 
     if len(combined) < 4:
         raise ValueError("Combined data is too short to decode.")
@@ -287,9 +738,32 @@ def _separate_bytes(combined: bytes) -> tuple[bytes, bytes]:
     return payload1, payload2
 
 
+# Container of several payloads: magic, version, number of sections and a directory of
+# the (uint32, little-endian) end offsets of the sections, followed by the sections.
+CONTAINER_MAGIC = b"LRFC"
+CONTAINER_VERSION = 1
+_CONTAINER_HEADER = struct.Struct("<4sBI")
+
+
+def is_container(combined: bytes) -> bool:
+    """Check whether a bytes object is a section container written by `combine_bytes`.
+
+    Args:
+        combined (bytes): A bytes object.
+
+    Returns:
+        bool: True for a container, False for the legacy nested format.
+    """
+
+    return bytes(combined[: len(CONTAINER_MAGIC)]) == CONTAINER_MAGIC
+
+
 def combine_bytes(payloads: Sequence[bytes]) -> bytes:
     """Combine multiple bytes objects into a single bytes object.
 
+    The payloads are written once, after a directory of their end offsets, so any of
+    them can be located without reading the others.
+
     Args:
         payloads (Sequence[bytes]): A sequence of bytes objects.
 
@@ -297,20 +771,47 @@ def combine_bytes(payloads: Sequence[bytes]) -> bytes:
         bytes: A single combined bytes object containing all payloads.
     """
 
-    return functools.reduce(_combine_bytes, payloads)
+    ends = np.cumsum([len(payload) for payload in payloads], dtype=np.int64)
+    if len(ends) and ends[-1] > 0xFFFFFFFF:
+        raise ValueError("payloads are too large to encode.")
+
+    header = _CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, len(payloads))
+    directory = ends.astype("<u4").tobytes()
+    return b"".join([header, directory, *payloads])
 
 
 def separate_bytes(combined: bytes, num_payloads: int = 2) -> tuple[bytes, ...]:
     """Split the combined bytes object into its parts (payloads).
 
+    Reads both the section container written by `combine_bytes` and the legacy nested
+    format, in which each payload is prefixed by its length. The payloads are returned
+    as views into `combined`, so nothing is copied.
+
     Args:
-        combined (bytes): The combined bytes object containing multiple payloads.
+        combined (bytes): The combined bytes-like object (e.g., bytes, memoryview or mmap)
+            containing multiple payloads.
         num_payloads (int, optional): The number of payloads. Defaults to 2.
 
     Returns:
-        tuple[bytes, ...]: A tuple containing the original bytes objects (payloads).
+        tuple[memoryview, ...]: A tuple containing views of the payloads.
     """
 
+    combined = memoryview(combined)
+    if is_container(combined):
+        _, version, count = _CONTAINER_HEADER.unpack_from(combined)
+        if version > CONTAINER_VERSION:
+            raise ValueError(f"Unsupported container version: {version}")
+        if count != num_payloads:
+            raise ValueError(f"Expected {num_payloads} payloads, found {count}.")
+
+        start = _CONTAINER_HEADER.size + 4 * count
+        ends = struct.unpack_from(f"<{count}I", combined, _CONTAINER_HEADER.size)
+        payloads, a = [], start
+        for end in ends:
+            payloads.append(combined[a : start + end])
+            a = start + end
+        return tuple(payloads)
+
     payloads = []
     payload1 = combined
     for _ in range(num_payloads - 1):
@@ -321,6 +822,46 @@ def separate_bytes(combined: bytes, num_payloads: int = 2) -> tuple[bytes, ...]:
     return tuple(payloads)
 
 
+def separate_layers(
+    encoded_image: bytes, max_bytes: Optional[int] = None
+) -> tuple[memoryview, list[memoryview]]:
+    """Split an encoded image into its header and its layers (see `encode_layers`).
+
+    Args:
+        encoded_image (bytes): The encoded image as a bytes-like object.
+        max_bytes (int, optional): Only read this many leading bytes, e.g., of a partial
+            download, and keep the layers that are complete within them (default: None).
+
+    Returns:
+        tuple[memoryview, list[memoryview]]: The header and the layers.
+    """
+
+    encoded_image = memoryview(encoded_image)
+    if not is_container(encoded_image):  # legacy streams have a single layer
+        encoded_metadata, encoded_factors = separate_bytes(encoded_image, 2)
+        return encoded_metadata, [encoded_factors]
+
+    _, _, count = _CONTAINER_HEADER.unpack_from(encoded_image)
+    if max_bytes is None:
+        encoded_metadata, *layers = separate_bytes(encoded_image, count)
+        return encoded_metadata, layers
+
+    start = _CONTAINER_HEADER.size + 4 * count
+    if max_bytes < start:
+        raise ValueError("'max_bytes' does not cover the header of the image.")
+    ends = struct.unpack_from(f"<{count}I", encoded_image, _CONTAINER_HEADER.size)
+    num_complete = sum(start + end <= max_bytes for end in ends)
+    if num_complete < 2:
+        raise ValueError("'max_bytes' does not cover the first layer of the image.")
+
+    starts = [start, *(start + end for end in ends[:-1])]
+    encoded_metadata, *layers = [
+        encoded_image[a : start + b]
+        for a, b in zip(starts[:num_complete], ends[:num_complete])
+    ]
+    return encoded_metadata, layers
+
+
 def dict_to_bytes(dictionary: dict) -> bytes:
     """Encode a dictionary into bytes.
 
@@ -340,23 +881,817 @@ def bytes_to_dict(encoded_bytes: bytes) -> dict:
     """Decode bytes back into a dictionary.
 
     Args:
-        encoded_bytes (bytes): The encoded dictionary as bytes.
+        encoded_bytes (bytes): The encoded dictionary as a bytes-like object.
 
     Returns:
         dict: The decoded dictionary.
     """
 
-    json_string = encoded_bytes.decode("utf-8")
+    json_string = str(encoded_bytes, "utf-8")
     dictionary = json.loads(json_string)
     return dictionary
 
 
-def encode_matrix(matrix: torch.Tensor, mode: str = "col") -> bytes:
+# Binary headers: each field is an index into one of these tables
+HEADER_DTYPES = (
+    "uint8",
+    "int8",
+    "int16",
+    "int32",
+    "int64",
+    "float16",
+    "bfloat16",
+    "float32",
+    "float64",
+    "bool",
+)
+HEADER_CODERS = ("zlib", "lzma", "bz2", "rans", "none")
+HEADER_CODECS = ("imf", "svd")
+HEADER_COLOR_SPACES = ("RGB", "YCbCr")
+
+# the first byte of a header tells its kind; JSON headers start with "{"
+_IMAGE_TAG, _MATRIX_TAG, _TENSOR_TAG, _BLOCKS_TAG = 1, 2, 3, 4
+# tag, codec, dtype, color space, flags, number of channels
+_IMAGE_HEADER = struct.Struct("<6B")
+# tag, dtype, coder, mode, flags, number of fibers
+_MATRIX_HEADER = struct.Struct("<5BI")
+# tag, dtype, coder, flags, number of dimensions
+_TENSOR_HEADER = struct.Struct("<5B")
+# tag, number of blocks, rows per block, number of rows
+_BLOCKS_HEADER = struct.Struct("<B3I")
+_HAS_PATCH, _HAS_BOUNDS, _HAS_ORIGINAL_SIZE, _HAS_PADDED_SIZE = 1, 2, 4, 8
+_HAS_RANK, _HAS_QUANTIZATION, _HAS_DICTIONARY, _HAS_PREDICTION = 16, 32, 64, 128
+
+
+def _per_channel(value: Any, color_space: str) -> list:
+    return [value] if color_space == "RGB" else list(value)
+
+
+def _from_channels(values: list, color_space: str) -> Any:
+    return values[0] if color_space == "RGB" else values
+
+
+def image_header_to_bytes(metadata: dict, codec: str) -> bytes:
+    """Encode the metadata of an encoded image into a compact binary header.
+
+    The metadata has the keys written by the codecs: 'dtype', 'color space', 'patch' and
+    optionally 'bounds', 'patch size', 'original size', 'padded size', 'rank',
+    'quantization' and 'prediction'. For RGB, the sizes, ranks, quantization parameters
+    and prediction modes are those of the single matrix; for YCbCr, they are lists with
+    one entry per channel.
+
+    Args:
+        metadata (dict): The metadata.
+        codec (str): The codec, 'imf' or 'svd'.
+
+    Returns:
+        bytes: The binary header.
+    """
+
+    color_space = metadata["color space"]
+    flags = (
+        _HAS_PATCH * bool(metadata["patch"])
+        | _HAS_BOUNDS * ("bounds" in metadata)
+        | _HAS_ORIGINAL_SIZE * ("original size" in metadata)
+        | _HAS_PADDED_SIZE * ("padded size" in metadata)
+        | _HAS_RANK * ("rank" in metadata)
+        | _HAS_QUANTIZATION * ("quantization" in metadata)
+        | _HAS_PREDICTION * ("prediction" in metadata)
+    )
+    num_channels = 1 if color_space == "RGB" else 3
+    fields = [
+        _IMAGE_HEADER.pack(
+            _IMAGE_TAG,
+            HEADER_CODECS.index(codec),
+            HEADER_DTYPES.index(metadata["dtype"]),
+            HEADER_COLOR_SPACES.index(color_space),
+            flags,
+            num_channels,
+        )
+    ]
+
+    if flags & _HAS_BOUNDS:
+        bounds = [math.nan if b is None else b for b in metadata["bounds"]]
+        fields.append(struct.pack("<2f", *bounds))
+    if flags & _HAS_PATCH:
+        fields.append(struct.pack("<2H", *metadata["patch size"]))
+
+    for key, fmt in (("original size", "<2I"), ("padded size", "<2I"), ("rank", "<I")):
+        if key in metadata:
+            for value in _per_channel(metadata[key], color_space):
+                fields.append(struct.pack(fmt, *np.atleast_1d(value).tolist()))
+
+    if flags & _HAS_QUANTIZATION:
+        qtz = metadata["quantization"]
+        for qtz_u, qtz_v in zip(
+            _per_channel(qtz["u"], color_space), _per_channel(qtz["v"], color_space)
+        ):
+            qtz_u = [math.nan] * 2 if qtz_u is None else qtz_u
+            qtz_v = [math.nan] * 2 if qtz_v is None else qtz_v
+            fields.append(struct.pack("<4d", *qtz_u, *qtz_v))
+
+    if flags & _HAS_PREDICTION:
+        for modes in _per_channel(metadata["prediction"], color_space):
+            fields.append(struct.pack("<H", len(modes)))
+            fields.append(bytes(PREDICTION_MODES.index(m) for m in modes))
+
+    return b"".join(fields)
+
+
+def bytes_to_image_header(encoded_header: bytes) -> dict:
+    """Decode the header of an encoded image, binary or (legacy) JSON.
+
+    Args:
+        encoded_header (bytes): The header written by `image_header_to_bytes` or
+            `dict_to_bytes`.
+
+    Returns:
+        dict: The metadata, with the same keys as when it was encoded. Binary headers
+            also have a 'codec' key.
+    """
+
+    if encoded_header[0] != _IMAGE_TAG:
+        return bytes_to_dict(encoded_header)
+
+    _, codec, dtype, color_space, flags, num_channels = _IMAGE_HEADER.unpack_from(
+        encoded_header
+    )
+    color_space = HEADER_COLOR_SPACES[color_space]
+    metadata = {
+        "codec": HEADER_CODECS[codec],
+        "dtype": HEADER_DTYPES[dtype],
+        "color space": color_space,
+        "patch": bool(flags & _HAS_PATCH),
+    }
+    offset = _IMAGE_HEADER.size
+
+    def read(fmt: str) -> tuple:
+        nonlocal offset
+        values = struct.unpack_from(fmt, encoded_header, offset)
+        offset += struct.calcsize(fmt)
+        return values
+
+    if flags & _HAS_BOUNDS:
+        metadata["bounds"] = [
+            None if math.isnan(b) else int(b) if b.is_integer() else b
+            for b in read("<2f")
+        ]
+    if flags & _HAS_PATCH:
+        metadata["patch size"] = list(read("<2H"))
+
+    for key, flag, fmt in (
+        ("original size", _HAS_ORIGINAL_SIZE, "<2I"),
+        ("padded size", _HAS_PADDED_SIZE, "<2I"),
+        ("rank", _HAS_RANK, "<I"),
+    ):
+        if flags & flag:
+            values = [list(read(fmt)) for _ in range(num_channels)]
+            values = [v[0] for v in values] if key == "rank" else values
+            metadata[key] = _from_channels(values, color_space)
+
+    if flags & _HAS_QUANTIZATION:
+        qtz_u, qtz_v = [], []
+        for _ in range(num_channels):
+            u_scale, u_min, v_scale, v_min = read("<4d")
+            qtz_u.append(None if math.isnan(u_scale) else [u_scale, u_min])
+            qtz_v.append(None if math.isnan(v_scale) else [v_scale, v_min])
+        metadata["quantization"] = {
+            "u": _from_channels(qtz_u, color_space),
+            "v": _from_channels(qtz_v, color_space),
+        }
+
+    if flags & _HAS_PREDICTION:
+        predictions = []
+        for _ in range(num_channels):
+            (num_modes,) = read("<H")
+            predictions.append([PREDICTION_MODES[m] for m in read(f"<{num_modes}B")])
+        metadata["prediction"] = _from_channels(predictions, color_space)
+
+    return metadata
+
+
+def _patch_grid_sizes(metadata: dict) -> list[tuple[int, int]]:
+    """The size of the patch grid of each channel of a patchified image."""
+
+    p, q = metadata["patch size"]
+    padded_sizes = _per_channel(metadata["padded size"], metadata["color space"])
+    return [(h // p, w // q) for h, w in padded_sizes]
+
+
+def dpcm_encode_factors(
+    factors: Sequence[torch.Tensor],
+    metadata: dict,
+    coder: str = "zlib",
+    dictionary: Optional[int] = None,
+) -> tuple[list[torch.Tensor], Any]:
+    """Predict the u factors of a patchified image from their neighbor patches.
+
+    Args:
+        factors (Sequence[torch.Tensor]): The integer factors (u, v) of each channel.
+        metadata (dict): The metadata of the image (see `image_header_to_bytes`).
+        coder (str, optional): The entropy coder of the factors (default: 'zlib').
+        dictionary (int, optional): The ID of a preset zlib dictionary (default: None).
+
+    Returns:
+        tuple[list[torch.Tensor], Any]: The factors, with residuals in place of the u
+            factors, and the prediction modes to store as the 'prediction' metadata.
+    """
+
+    factors, modes = list(factors), []
+    for i, grid_size in enumerate(_patch_grid_sizes(metadata)):
+        channel_modes = dpcm_modes(factors[2 * i], grid_size, coder, dictionary)
+        factors[2 * i] = dpcm_encode(factors[2 * i], grid_size, channel_modes)
+        modes.append(channel_modes)
+
+    return factors, _from_channels(modes, metadata["color space"])
+
+
+def dpcm_decode_factors(
+    factors: Sequence[torch.Tensor], metadata: dict
+) -> list[torch.Tensor]:
+    """Invert `dpcm_encode_factors`, if the image was encoded with prediction.
+
+    Args:
+        factors (Sequence[torch.Tensor]): The decoded factors (u, v) of each channel.
+        metadata (dict): The metadata of the image.
+
+    Returns:
+        list[torch.Tensor]: The factors.
+    """
+
+    factors = list(factors)
+    if "prediction" not in metadata:
+        return factors
+
+    modes = _per_channel(metadata["prediction"], metadata["color space"])
+    for i, grid_size in enumerate(_patch_grid_sizes(metadata)):
+        rank = factors[2 * i].shape[-1]  # fewer components in a preview
+        factors[2 * i] = dpcm_decode(factors[2 * i], grid_size, modes[i][:rank])
+
+    return factors
+
+
+def _tensor_header_to_bytes(metadata: dict) -> bytes:
+    """Encode the metadata of `encode_matrix` or `encode_tensor` into a binary header."""
+
+    dtype = HEADER_DTYPES.index(metadata["dtype"])
+    coder = HEADER_CODERS.index(metadata["coder"])
+    flags = _HAS_BOUNDS * ("bounds" in metadata) | _HAS_DICTIONARY * (
+        "dictionary" in metadata
+    )
+    if "num_fibers" in metadata:
+        mode = ("col", "row").index(metadata["mode"])
+        header = _MATRIX_HEADER.pack(
+            _MATRIX_TAG, dtype, coder, mode, flags, metadata["num_fibers"]
+        )
+        if flags & _HAS_BOUNDS:
+            header += struct.pack("<2hI", *metadata["bounds"], metadata["length"])
+    else:
+        shape = metadata["shape"]
+        header = _TENSOR_HEADER.pack(_TENSOR_TAG, dtype, coder, flags, len(shape))
+        header += struct.pack(f"<{len(shape)}I", *shape)
+        if flags & _HAS_BOUNDS:
+            header += struct.pack("<2h", *metadata["bounds"])
+
+    if flags & _HAS_DICTIONARY:
+        header += struct.pack("<B", metadata["dictionary"])
+
+    return header
+
+
+def _bytes_to_tensor_header(encoded_header: bytes) -> dict:
+    """Decode the header of `encode_matrix` or `encode_tensor`, binary or (legacy) JSON."""
+
+    tag = encoded_header[0]
+    if tag == _MATRIX_TAG:
+        _, dtype, coder, mode, flags, num_fibers = _MATRIX_HEADER.unpack_from(
+            encoded_header
+        )
+        offset = _MATRIX_HEADER.size
+        metadata = {"num_fibers": num_fibers, "mode": ("col", "row")[mode]}
+        if flags & _HAS_BOUNDS:
+            lo, hi, length = struct.unpack_from("<2hI", encoded_header, offset)
+            metadata.update({"bounds": [lo, hi], "length": length})
+            offset += struct.calcsize("<2hI")
+    elif tag == _TENSOR_TAG:
+        _, dtype, coder, flags, ndim = _TENSOR_HEADER.unpack_from(encoded_header)
+        offset = _TENSOR_HEADER.size
+        metadata = {
+            "shape": list(struct.unpack_from(f"<{ndim}I", encoded_header, offset))
+        }
+        offset += 4 * ndim
+        if flags & _HAS_BOUNDS:
+            metadata["bounds"] = list(struct.unpack_from("<2h", encoded_header, offset))
+            offset += struct.calcsize("<2h")
+    else:
+        return bytes_to_dict(encoded_header)
+
+    if flags & _HAS_DICTIONARY:
+        metadata["dictionary"] = encoded_header[offset]
+
+    metadata.update({"dtype": HEADER_DTYPES[dtype], "coder": HEADER_CODERS[coder]})
+    return metadata
+
+
+# Interleaved static rANS: 32-bit states, 16-bit renormalization words and
+# frequencies quantized to a total of 2 ** RANS_PROB_BITS
+RANS_PROB_BITS = 14
+RANS_LOWER_BOUND = 1 << 16
+_RANS_HEADER = struct.Struct("<BbBI")
+
+
+def _rans_frequencies(counts: np.ndarray) -> np.ndarray:
+    """Quantize symbol counts to frequencies that sum to 2 ** RANS_PROB_BITS, keeping
+    every occurring symbol at a frequency of at least 1."""
+
+    total = 1 << RANS_PROB_BITS
+    freqs = np.where(counts > 0, np.maximum(counts * total // counts.sum(), 1), 0)
+    excess = int(freqs.sum()) - total
+    # hand the surplus to (or take the excess from) the most frequent symbols
+    for s in np.argsort(-freqs, kind="stable"):
+        if excess == 0:
+            break
+        change = excess if excess < 0 else min(excess, int(freqs[s]) - 1)
+        freqs[s] -= change
+        excess -= change
+
+    return freqs.astype(np.uint16)
+
+
+def _rans_encode_group(symbols: np.ndarray, lanes: int) -> list[bytes]:
+    """rANS-encode P payloads of n int8 symbols each, given as a P × n array."""
+
+    P, n = symbols.shape
+    lo = symbols.min(axis=1).astype(np.int64)
+    symbols = symbols.astype(np.int64) - lo[:, None]
+    # at least 256 symbols per lane, so that the final states stay a small overhead
+    lanes = max(min(lanes, n // 256), 1)
+    num_steps = -(-n // lanes)
+
+    # pad with the most frequent symbol of each payload, which is cheapest to code
+    num_symbols = int(symbols.max()) + 1
+    padding = np.stack([np.bincount(row, minlength=num_symbols) for row in symbols])
+    padding = np.repeat(padding.argmax(axis=1)[:, None], num_steps * lanes - n, axis=1)
+    symbols = np.concatenate([symbols, padding], axis=1)
+
+    counts = [np.bincount(row, minlength=num_symbols) for row in symbols]
+    freqs = np.stack([_rans_frequencies(c) for c in counts]).astype(np.uint64)
+    cum_freqs = np.cumsum(freqs, axis=1) - freqs
+    symbols = symbols.reshape(P, num_steps, lanes)
+
+    bits = np.uint64(RANS_PROB_BITS)
+    x_max_unit = np.uint64((RANS_LOWER_BOUND >> RANS_PROB_BITS) << 16)
+    rows = np.arange(P)[:, None]
+    x = np.full((P, lanes), RANS_LOWER_BOUND, dtype=np.uint64)
+    words = np.empty((num_steps, P, lanes), dtype="<u2")
+    renorms = np.empty((num_steps, P, lanes), dtype=bool)
+    for t in range(num_steps - 1, -1, -1):
+        s = symbols[:, t]
+        f, c = freqs[rows, s], cum_freqs[rows, s]
+        renorm = x >= x_max_unit * f
+        words[t], renorms[t] = x & np.uint64(0xFFFF), renorm
+        x = np.where(renorm, x >> np.uint64(16), x)
+        x = ((x // f) << bits) + (x % f) + c
+
+    encoded = []
+    for p in range(P):
+        num_used = int(np.flatnonzero(freqs[p]).max()) + 1
+        header = _RANS_HEADER.pack(lanes, lo[p], num_used - 1, n)
+        body = [
+            freqs[p, :num_used].astype("<u2").tobytes(),
+            x[p].astype("<u4").tobytes(),
+            # the decoder reads the words in order of steps, then lanes
+            words[:, p][renorms[:, p]].tobytes(),
+        ]
+        encoded.append(b"".join([header, *body]))
+
+    return encoded
+
+
+def _rans_decode_group(payloads: Sequence[bytes]) -> np.ndarray:
+    """Decode P rANS payloads with the same length and number of lanes into a P × n
+    array of int8 symbols."""
+
+    P = len(payloads)
+    lanes, _, _, n = _RANS_HEADER.unpack_from(payloads[0])
+    num_steps = -(-n // lanes)
+
+    lo = np.empty(P, dtype=np.int64)
+    freqs = np.zeros((P, 256), dtype=np.uint64)
+    x = np.empty((P, lanes), dtype=np.uint64)
+    words, starts = [], np.zeros(P, dtype=np.int64)
+    for p, payload in enumerate(payloads):
+        _, lo[p], num_symbols, _ = _RANS_HEADER.unpack_from(payload)
+        num_symbols += 1
+        offset = _RANS_HEADER.size
+        freqs[p, :num_symbols] = np.frombuffer(
+            payload, dtype="<u2", count=num_symbols, offset=offset
+        )
+        offset += 2 * num_symbols
+        x[p] = np.frombuffer(payload, dtype="<u4", count=lanes, offset=offset)
+        offset += 4 * lanes
+        words.append(np.frombuffer(payload, dtype="<u2", offset=offset))
+        starts[p] = starts[p - 1] + len(words[p - 1]) if p else 0
+
+    # one extra word, so that lanes that do not read still index a valid word
+    words = np.concatenate([*words, np.zeros(1, dtype="<u2")]).astype(np.uint64)
+    cum_freqs = np.cumsum(freqs, axis=1) - freqs
+    lookup = np.stack(
+        [np.repeat(np.arange(256, dtype=np.uint8), f.astype(np.int64)) for f in freqs]
+    )
+
+    bits, mask = np.uint64(RANS_PROB_BITS), np.uint64((1 << RANS_PROB_BITS) - 1)
+    rows = np.arange(P)[:, None]
+    symbols = np.empty((P, num_steps, lanes), dtype=np.uint8)
+    for t in range(num_steps):
+        slot = x & mask
+        s = lookup[rows, slot]
+        x = freqs[rows, s] * (x >> bits) + slot - cum_freqs[rows, s]
+        renorm = x < RANS_LOWER_BOUND
+        index = starts[:, None] + np.cumsum(renorm, axis=1) - 1
+        x = np.where(renorm, (x << np.uint64(16)) | words[np.where(renorm, index, -1)], x)
+        starts += renorm.sum(axis=1)
+        symbols[:, t] = s
+
+    symbols = symbols.reshape(P, -1)[:, :n]
+    return (symbols.astype(np.int64) + lo[:, None]).astype(np.int8)
+
+
+def rans_compress(data: bytes | Sequence[bytes], lanes: int = 32) -> bytes | list[bytes]:
+    """Compress bytes with a static rANS coder over interleaved states.
+
+    The bytes are read as int8 symbols, so the entries of small signed (or unsigned)
+    integer factors, e.g., IMF factors within `bounds=(-16, 15)`, form a small
+    contiguous alphabet. Its order-0 frequencies are stored in the header. The lanes,
+    and all payloads of the same length, are coded in lockstep with vectorized numpy
+    operations, so passing all fibers of a matrix at once is much faster than one by one.
+
+    Args:
+        data (bytes or Sequence[bytes]): The bytes to compress, or several payloads.
+        lanes (int, optional): The maximum number of interleaved rANS states per payload
+            (default: 32).
+
+    Returns:
+        bytes or list[bytes]: The compressed bytes of each payload.
+    """
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return rans_compress([data], lanes=lanes)[0]
+
+    groups = {}
+    for i, payload in enumerate(data):
+        groups.setdefault(len(payload), []).append(i)
+
+    encoded = [_RANS_HEADER.pack(0, 0, 0, 0)] * len(data)
+    for n, indices in groups.items():
+        if n == 0:
+            continue
+        symbols = np.stack([np.frombuffer(data[i], dtype=np.int8) for i in indices])
+        for i, payload in zip(indices, _rans_encode_group(symbols, lanes)):
+            encoded[i] = payload
+
+    return encoded
+
+
+def rans_decompress(data: bytes | Sequence[bytes]) -> bytes | list[bytes]:
+    """Decompress bytes compressed with `rans_compress`.
+
+    Args:
+        data (bytes or Sequence[bytes]): The compressed bytes, or several payloads.
+
+    Returns:
+        bytes or list[bytes]: The decompressed bytes of each payload.
+    """
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return rans_decompress([data])[0]
+
+    groups = {}
+    for i, payload in enumerate(data):
+        lanes, _, _, n = _RANS_HEADER.unpack_from(payload)
+        groups.setdefault((lanes, n), []).append(i)
+
+    decoded = [b""] * len(data)
+    for (_, n), indices in groups.items():
+        if n == 0:
+            continue
+        symbols = _rans_decode_group([data[i] for i in indices])
+        for i, row in zip(indices, symbols):
+            decoded[i] = row.tobytes()
+
+    return decoded
+
+
+# preset zlib dictionaries shipped with the library, by ID (0 means no dictionary)
+ZLIB_DICTIONARIES = {1: "imf_thumbnails.zdict"}
+
+
+@functools.lru_cache
+def zlib_dictionary(dictionary_id: int) -> bytes:
+    """Load a preset zlib dictionary shipped with the library.
+
+    Args:
+        dictionary_id (int): The ID of the dictionary, a key of `ZLIB_DICTIONARIES`.
+
+    Returns:
+        bytes: The dictionary.
+    """
+
+    path = os.path.join(
+        os.path.dirname(__file__), "dictionaries", ZLIB_DICTIONARIES[dictionary_id]
+    )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def train_zlib_dictionary(
+    samples: Sequence[bytes], size: int = 256, gram_size: int = 8, segment_size: int = 64
+) -> bytes:
+    """Train a preset zlib dictionary from sample payloads, e.g., factor fibers.
+
+    Greedily picks the segments of the samples that cover the most frequent n-grams
+    (n = `gram_size`) not covered yet, in the spirit of the COVER algorithm of zstd. The
+    best segments go last, as zlib encodes matches at short distances more cheaply.
+
+    Args:
+        samples (Sequence[bytes]): The sample payloads.
+        size (int, optional): The maximum size of the dictionary (default: 256).
+        gram_size (int, optional): The length of the counted n-grams (default: 8).
+        segment_size (int, optional): The length of the picked segments (default: 64).
+
+    Returns:
+        bytes: The dictionary.
+    """
+
+    data = np.frombuffer(b"".join(samples), dtype=np.uint8)
+    boundaries = np.cumsum([len(sample) for sample in samples])[:-1]
+
+    # n-grams (and segments) that cross a boundary between samples are left out
+    def inside(length: int) -> np.ndarray:
+        mask = np.ones(max(len(data) - length + 1, 0), dtype=bool)
+        for b in boundaries:
+            mask[max(b - length + 1, 0) : b] = False
+        return mask
+
+    num_grams = len(data) - gram_size + 1
+    grams = np.zeros(max(num_grams, 0), dtype=np.uint64)
+    for j in range(gram_size):
+        grams |= data[j : j + num_grams].astype(np.uint64) << np.uint64(8 * j)
+    valid = inside(gram_size)
+    _, ids, counts = np.unique(grams[valid], return_inverse=True, return_counts=True)
+    weights = counts.astype(np.float64)
+    gram_ids = np.full(num_grams, -1)
+    gram_ids[valid] = ids
+
+    grams_per_segment = segment_size - gram_size + 1
+    segment_valid = inside(segment_size)
+    segments = []
+    while len(segments) * segment_size < size and segment_valid.any():
+        gram_weights = np.where(gram_ids >= 0, weights[gram_ids], 0)
+        cum_weights = np.concatenate([[0], np.cumsum(gram_weights)])
+        scores = cum_weights[grams_per_segment:] - cum_weights[:-grams_per_segment]
+        scores = np.where(segment_valid, scores, -1)
+        best = int(np.argmax(scores))
+        if scores[best] <= 0:
+            break
+        segments.append(data[best : best + segment_size].tobytes())
+        covered = gram_ids[best : best + grams_per_segment]
+        weights[covered[covered >= 0]] = 0
+
+    return b"".join(reversed(segments))[-size:]
+
+
+def _zlib_compress(data: bytes, level: int = 9, zdict: Optional[bytes] = None) -> bytes:
+    """zlib compression; with a preset dictionary, as a raw deflate stream."""
+
+    if zdict is None:
+        return zlib.compress(data, level=level)
+
+    # raw deflate drops the zlib header and checksum, which dominate short payloads
+    compressor = zlib.compressobj(level, wbits=-15, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _zlib_decompress(data: bytes, zdict: Optional[bytes] = None) -> bytes:
+    """Inverse of `_zlib_compress`."""
+
+    if zdict is None:
+        return zlib.decompress(data)
+
+    decompressor = zlib.decompressobj(wbits=-15, zdict=zdict)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _identity(data: bytes) -> bytes:
+    return data
+
+
+# entropy coders by name: compress, decompress, name of the level argument and whether
+# they take several payloads at once
+ENTROPY_CODERS = {
+    "none": (_identity, _identity, None, False),
+    "zlib": (_zlib_compress, _zlib_decompress, "level", False),
+    "lzma": (lzma.compress, lzma.decompress, "preset", False),
+    "bz2": (bz2.compress, bz2.decompress, "compresslevel", False),
+    "rans": (rans_compress, rans_decompress, None, True),
+}
+
+
+def _parse_coder(coder: str) -> tuple[str, dict]:
+    """Split a coder spec such as 'zlib' or 'zlib-6' into its name and arguments."""
+
+    name, _, level = coder.partition("-")
+    if name not in ENTROPY_CODERS:
+        raise ValueError(f"Unknown entropy coder: {name}")
+
+    level_arg = ENTROPY_CODERS[name][2]
+    if level and level_arg is None:
+        raise ValueError(f"The entropy coder {name} has no levels.")
+    elif level:
+        return name, {level_arg: int(level)}
+    elif name == "zlib":
+        return name, {"level": 9}
+    else:
+        return name, {}
+
+
+def worker_pool(num_workers: int) -> contextlib.AbstractContextManager:
+    """A thread pool for the `executor` arguments of the (de)compression functions.
+
+    An encoder or decoder creates one pool per call, with
+    `with worker_pool(num_workers) as executor: ...`, and submits the work on all
+    factors to it. With a single worker, the executor is None.
+
+    Args:
+        num_workers (int): The number of threads.
+
+    Returns:
+        contextlib.AbstractContextManager: A context manager of the executor.
+    """
+
+    if num_workers > 1:
+        return ThreadPoolExecutor(max_workers=num_workers)
+    return contextlib.nullcontext()
+
+
+def _map(fn: Callable, items: Sequence, executor: Optional[Executor] = None) -> list:
+    """Apply a function to items, concurrently on `executor` if given.
+
+    An item that no worker has started yet when its result is needed is processed by
+    the calling thread itself, so the function may map over further items on the same
+    executor without a deadlock, e.g., the factors of an image and then their fibers.
+    """
+
+    if executor is None or len(items) < 2:
+        return [fn(item) for item in items]
+
+    futures = [executor.submit(fn, item) for item in items]
+    return [
+        fn(item) if future.cancel() else future.result()
+        for item, future in zip(items, futures)
+    ]
+
+
+def entropy_encode(
+    data: bytes | Sequence[bytes],
+    coder: str = "zlib",
+    executor: Optional[Executor] = None,
+    zdict: Optional[bytes] = None,
+) -> bytes | list[bytes]:
+    """Compress bytes with a lossless entropy coder.
+
+    Args:
+        data (bytes or Sequence[bytes]): The bytes to compress, or several payloads to
+            compress separately.
+        coder (str, optional): The coder, one of 'zlib', 'lzma', 'bz2', 'rans' and 'none'
+            (no compression), optionally followed by a level, e.g., 'zlib-6' or 'lzma-9'
+            (default: 'zlib', at level 9).
+        executor (Executor, optional): A thread pool (see `worker_pool`) that compresses
+            several payloads concurrently; the stdlib codecs release the GIL
+            (default: None).
+        zdict (bytes, optional): A preset dictionary for 'zlib' (see `zlib_dictionary`),
+            with which payloads are stored as raw deflate streams (default: None).
+
+    Returns:
+        bytes or list[bytes]: The compressed bytes of each payload.
+    """
+
+    name, kwargs = _parse_coder(coder)
+    if zdict is not None:
+        assert name == "zlib", "Preset dictionaries are only supported by 'zlib'."
+        kwargs["zdict"] = zdict
+    compress, _, _, batched = ENTROPY_CODERS[name]
+    if batched or isinstance(data, (bytes, bytearray, memoryview)):
+        return compress(data, **kwargs)
+
+    return _map(functools.partial(compress, **kwargs), data, executor)
+
+
+def entropy_decode(
+    data: bytes | Sequence[bytes],
+    coder: str = "zlib",
+    executor: Optional[Executor] = None,
+    zdict: Optional[bytes] = None,
+) -> bytes | list[bytes]:
+    """Decompress bytes compressed with `entropy_encode`.
+
+    Args:
+        data (bytes or Sequence[bytes]): The compressed bytes, or several payloads.
+        coder (str, optional): The name of the coder (default: 'zlib').
+        executor (Executor, optional): A thread pool (see `worker_pool`) that
+            decompresses several payloads concurrently (default: None).
+        zdict (bytes, optional): The preset dictionary used by `entropy_encode`
+            (default: None).
+
+    Returns:
+        bytes or list[bytes]: The decompressed bytes of each payload.
+    """
+
+    name, _ = _parse_coder(coder)
+    _, decompress, _, batched = ENTROPY_CODERS[name]
+    if zdict is not None:
+        decompress = functools.partial(decompress, zdict=zdict)
+    if batched or isinstance(data, (bytes, bytearray, memoryview)):
+        return decompress(data)
+
+    return _map(decompress, data, executor)
+
+
+def bit_width(bounds: tuple[int, int]) -> int:
+    """The number of bits of an integer within the (inclusive) bounds, after offsetting
+    by the lower bound.
+
+    Args:
+        bounds (tuple[int, int]): The lower and upper bound.
+
+    Returns:
+        int: The bit width, e.g., 5 for the bounds (-16, 15).
+    """
+
+    lo, hi = bounds
+    return max(int(hi - lo).bit_length(), 1)
+
+
+def pack_bits(array: np.ndarray, bounds: tuple[int, int]) -> bytes:
+    """Pack integers within bounds densely, with `bit_width(bounds)` bits per entry.
+
+    Args:
+        array (np.ndarray): The integers to pack, within the bounds.
+        bounds (tuple[int, int]): The lower and upper bound of the integers.
+
+    Returns:
+        bytes: The packed integers, least significant bit first.
+    """
+
+    bits = bit_width(bounds)
+    values = array.ravel().astype(np.int64) - bounds[0]
+    values = (values[:, None] >> np.arange(bits)) & 1
+    return np.packbits(values.astype(np.uint8), bitorder="little").tobytes()
+
+
+def unpack_bits(
+    data: bytes, bounds: tuple[int, int], count: int, dtype: np.dtype
+) -> np.ndarray:
+    """Unpack integers packed with `pack_bits`.
+
+    Args:
+        data (bytes): The packed integers.
+        bounds (tuple[int, int]): The lower and upper bound of the integers.
+        count (int): The number of integers.
+        dtype (np.dtype): The dtype of the unpacked integers.
+
+    Returns:
+        np.ndarray: The unpacked integers, as a 1D array.
+    """
+
+    bits = bit_width(bounds)
+    values = np.unpackbits(
+        np.frombuffer(data, dtype=np.uint8), count=count * bits, bitorder="little"
+    )
+    values = values.reshape(count, bits) @ (1 << np.arange(bits))
+    return (values + bounds[0]).astype(dtype)
+
+
+def encode_matrix(
+    matrix: torch.Tensor,
+    mode: str = "col",
+    coder: str = "zlib",
+    bounds: Optional[tuple[int, int]] = None,
+    executor: Optional[Executor] = None,
+    dictionary: Optional[int] = None,
+) -> bytes:
     """Encode a 2D tensor (matrix) into a compressed bytes object.
 
     Args:
         matrix (torch.Tensor): A 2D tensor to encode.
         mode (str, optional): Mode of encoding ('col' for column-wise, 'row' for row-wise). Defaults to 'col'.
+        coder (str, optional): The entropy coder, see `entropy_encode`. Defaults to 'zlib'.
+        bounds (tuple[int, int], optional): The bounds of an integer matrix. If given, the
+            fibers are bit-packed (see `pack_bits`) before entropy coding. Defaults to None.
+        executor (Executor, optional): A thread pool (see `worker_pool`) that compresses the
+            fibers. Defaults to None.
+        dictionary (int, optional): The ID of a preset zlib dictionary (see `zlib_dictionary`)
+            to compress the fibers with. Defaults to None.
 
     Returns:
         bytes: The encoded matrix as a bytes object.
@@ -366,23 +1701,30 @@ def encode_matrix(matrix: torch.Tensor, mode: str = "col") -> bytes:
     assert mode in {"col", "row"}, "'mode' must be either 'col' or 'row'."
 
     if mode == "col":
-        fibers = matrix.split(split_size=1, dim=1)
+        fibers = matrix.mT.unbind(0)
 
     else:  # row
-        fibers = matrix.split(split_size=1, dim=0)
+        fibers = matrix.unbind(0)
 
-    encoded_fibers = []
-    for fiber in fibers:
-        encoded_fiber = fiber.numpy().tobytes()
-        encoded_fiber = zlib.compress(encoded_fiber, level=9)
-        encoded_fibers.append(encoded_fiber)
+    if bounds is None:
+        encoded_fibers = [fiber.numpy().tobytes() for fiber in fibers]
+    else:
+        encoded_fibers = [pack_bits(fiber.numpy(), bounds) for fiber in fibers]
+    zdict = None if dictionary is None else zlib_dictionary(dictionary)
+    encoded_fibers = entropy_encode(encoded_fibers, coder, executor, zdict)
 
     metadata = {
         "num_fibers": len(fibers),
         "mode": mode,
         "dtype": str(matrix.dtype).split(".")[-1],
+        "coder": _parse_coder(coder)[0],
     }
-    encoded_metadata = dict_to_bytes(metadata)
+    if bounds is not None:
+        metadata["bounds"] = bounds
+        metadata["length"] = fibers[0].numel() if fibers else 0
+    if dictionary is not None:
+        metadata["dictionary"] = dictionary
+    encoded_metadata = _tensor_header_to_bytes(metadata)
 
     encoded_fibers = combine_bytes(encoded_fibers)
     encoded_matrix = combine_bytes([encoded_metadata, encoded_fibers])
@@ -390,12 +1732,21 @@ def encode_matrix(matrix: torch.Tensor, mode: str = "col") -> bytes:
     return encoded_matrix
 
 
-def decode_matrix(encoded_matrix: bytes, mode: str = "col") -> torch.Tensor:
+def decode_matrix(
+    encoded_matrix: bytes,
+    mode: str = "col",
+    executor: Optional[Executor] = None,
+    num_fibers: Optional[int] = None,
+) -> torch.Tensor:
     """Decode a compressed bytes object back into a 2D tensor (matrix).
 
     Args:
-        encoded_matrix (bytes): The encoded matrix as a bytes object.
+        encoded_matrix (bytes): The encoded matrix as a bytes-like object.
         mode (str, optional): Mode of decoding ('col' for column-wise, 'row' for row-wise). Defaults to 'col'.
+        executor (Executor, optional): A thread pool (see `worker_pool`) that decompresses
+            the fibers. Defaults to None.
+        num_fibers (int, optional): Only decode this many leading fibers, e.g., the leading
+            components of a factor. Defaults to None (all).
 
     Returns:
         torch.Tensor: The decoded 2D tensor.
@@ -405,61 +1756,127 @@ def decode_matrix(encoded_matrix: bytes, mode: str = "col") -> torch.Tensor:
 
     encoded_metadata, encoded_fibers = separate_bytes(encoded_matrix)
 
-    metadata = bytes_to_dict(encoded_metadata)
-    num_fibers = metadata["num_fibers"]
+    metadata = _bytes_to_tensor_header(encoded_metadata)
+    total_fibers = metadata["num_fibers"]
+    num_fibers = total_fibers if num_fibers is None else min(num_fibers, total_fibers)
     mode = metadata["mode"]
     dtype = metadata["dtype"]
-
-    encoded_fibers = separate_bytes(encoded_fibers, num_payloads=num_fibers)
-    fibers = []
-    for encoded_fiber in encoded_fibers:
-        encoded_fiber = zlib.decompress(encoded_fiber)
-        fiber = np.frombuffer(encoded_fiber, dtype=np.dtype(dtype))
-        fibers.append(fiber)
+    coder = metadata.get("coder", "zlib")
+    bounds = metadata.get("bounds")
+    dictionary = metadata.get("dictionary")
+    zdict = None if dictionary is None else zlib_dictionary(dictionary)
+
+    # the fibers are decompressed straight into the rows of a single array; columns are
+    # returned as a transposed view of it
+    encoded_fibers = separate_bytes(encoded_fibers, num_payloads=total_fibers)
+    encoded_fibers = encoded_fibers[:num_fibers]
+    fibers = np.empty((0, 0), dtype=np.dtype(dtype))
+    if num_fibers:
+        encoded_fibers = entropy_decode(encoded_fibers, coder, executor, zdict)
+    for i, encoded_fiber in enumerate(encoded_fibers):
+        if bounds is None:
+            fiber = np.frombuffer(encoded_fiber, dtype=np.dtype(dtype))
+        else:
+            fiber = unpack_bits(
+                encoded_fiber, bounds, metadata["length"], np.dtype(dtype)
+            )
+        if i == 0:
+            fibers = np.empty((num_fibers, len(fiber)), dtype=fiber.dtype)
+        fibers[i] = fiber
 
     if mode == "col":
-        matrix = np.stack(fibers, axis=1)
+        matrix = fibers.T
 
     else:  # row
-        matrix = np.stack(fibers, axis=0)
+        matrix = fibers
 
     return torch.from_numpy(matrix)
 
 
-def encode_tensor(tensor: torch.Tensor, *args, **kwargs) -> bytes:
-    """Encode a PyTorch tensor and its metadata using zlib compression.
+def encode_tensor(
+    tensor: torch.Tensor,
+    *args,
+    coder: str = "zlib",
+    bounds: Optional[tuple[int, int]] = None,
+    dictionary: Optional[int] = None,
+    block_rows: Optional[int] = None,
+    **kwargs,
+) -> bytes:
+    """Encode a PyTorch tensor and its metadata using lossless compression.
 
     Args:
         tensor (torch.Tensor): The tensor to encode.
+        coder (str, optional): The entropy coder, see `entropy_encode` (default: 'zlib').
+        bounds (tuple[int, int], optional): The bounds of an integer tensor. If given, the
+            entries are bit-packed (see `pack_bits`) before entropy coding (default: None).
+        dictionary (int, optional): The ID of a preset zlib dictionary (see
+            `zlib_dictionary`) to compress with (default: None).
+        block_rows (int, optional): Encode a matrix in independent blocks of this many
+            rows, behind an index of the blocks, so that `decode_tensor` can decode some
+            rows without the others (default: None).
         *args: Additional positional arguments for `encode_matrix`.
         **kwargs: Additional keyword arguments for `encode_matrix`.
 
     Returns:
         bytes: A single bytes object containing both encoded data and metadata.
     """
+    if block_rows is not None:
+        assert tensor.ndim == 2, "Only matrices can be encoded in blocks."
+        blocks = tensor.split(block_rows, dim=0)
+        encoded_blocks = _map(
+            lambda block: encode_tensor(
+                block, *args, coder=coder, bounds=bounds, dictionary=dictionary, **kwargs
+            ),
+            blocks,
+            kwargs.get("executor"),
+        )
+        encoded_metadata = _BLOCKS_HEADER.pack(
+            _BLOCKS_TAG, len(blocks), block_rows, len(tensor)
+        )
+        return combine_bytes([encoded_metadata, combine_bytes(encoded_blocks)])
+
     if tensor.ndim == 2:
-        return encode_matrix(tensor, *args, **kwargs)
+        return encode_matrix(
+            tensor, *args, coder=coder, bounds=bounds, dictionary=dictionary, **kwargs
+        )
 
     # Convert the tensor to bytes
-    encoded_array = tensor.numpy().tobytes()
+    if bounds is None:
+        encoded_array = tensor.numpy().tobytes()
+    else:
+        encoded_array = pack_bits(tensor.numpy(), bounds)
 
     # Encode the bytes using a lossless compression
-    encoded_array = zlib.compress(encoded_array, level=9)
+    zdict = None if dictionary is None else zlib_dictionary(dictionary)
+    encoded_array = entropy_encode(encoded_array, coder, zdict=zdict)
 
     # Prepare metadata
-    metadata = {"shape": tensor.shape, "dtype": str(tensor.dtype).split(".")[-1]}
-    encoded_metadata = dict_to_bytes(metadata)
+    metadata = {
+        "shape": tensor.shape,
+        "dtype": str(tensor.dtype).split(".")[-1],
+        "coder": _parse_coder(coder)[0],
+    }
+    if bounds is not None:
+        metadata["bounds"] = bounds
+    if dictionary is not None:
+        metadata["dictionary"] = dictionary
+    encoded_metadata = _tensor_header_to_bytes(metadata)
 
     # Combine metadata and tensor data into a single bytes object
     encoded_tensor = combine_bytes([encoded_metadata, encoded_array])
     return encoded_tensor
 
 
-def decode_tensor(encoded_tensor: bytes, *args, **kwargs) -> torch.Tensor:
+def decode_tensor(
+    encoded_tensor: bytes, *args, rows: Optional[tuple[int, int]] = None, **kwargs
+) -> torch.Tensor:
     """Decode a combined bytes object back into a PyTorch tensor using the encoded shape and dtype.
 
     Args:
-        encoded_tensor (bytes): The combined bytes object containing both encoded data and metadata.
+        encoded_tensor (bytes): The combined bytes-like object containing both encoded data and metadata.
+        rows (tuple[int, int], optional): Only return the rows [start, stop) of the
+            tensor. Of a matrix encoded in blocks, only the blocks covering them are
+            decoded (default: None).
         *args: Additional positional arguments for `decode_matrix`.
         **kwargs: Additional keyword arguments for `decode_matrix`.
 
@@ -470,21 +1887,336 @@ def decode_tensor(encoded_tensor: bytes, *args, **kwargs) -> torch.Tensor:
     # Extract metadata and array data
     encoded_metadata, encoded_array = separate_bytes(encoded_tensor)
 
+    if encoded_metadata[0] == _BLOCKS_TAG:
+        _, num_blocks, block_rows, num_rows = _BLOCKS_HEADER.unpack_from(encoded_metadata)
+        start, stop = (0, num_rows) if rows is None else rows
+        first, last = start // block_rows, max(-(-stop // block_rows), 1)
+        encoded_blocks = separate_bytes(encoded_array, num_blocks)[first:last]
+        blocks = _map(
+            lambda block: decode_tensor(block, *args, **kwargs),
+            encoded_blocks,
+            kwargs.get("executor"),
+        )
+        offset = first * block_rows
+        return torch.cat(blocks)[start - offset : stop - offset]
+
     # Decode metadata
-    metadata = bytes_to_dict(encoded_metadata)
+    metadata = _bytes_to_tensor_header(encoded_metadata)
 
     if "num_fibers" in metadata:
-        return decode_matrix(encoded_tensor)
+        matrix = decode_matrix(encoded_tensor, *args, **kwargs)
+        return matrix if rows is None else matrix[rows[0] : rows[1]]
 
     shape = metadata["shape"]
     dtype = metadata["dtype"]
 
     # Decode the array data
-    array = zlib.decompress(encoded_array)
+    dictionary = metadata.get("dictionary")
+    zdict = None if dictionary is None else zlib_dictionary(dictionary)
+    array = entropy_decode(encoded_array, metadata.get("coder", "zlib"), zdict=zdict)
 
     # Convert back to tensor
-    decoded_tensor = torch.from_numpy(
-        np.frombuffer(array, dtype=np.dtype(dtype)).reshape(shape)
+    if "bounds" in metadata:
+        array = unpack_bits(array, metadata["bounds"], prod(shape), np.dtype(dtype))
+    else:
+        array = np.frombuffer(array, dtype=np.dtype(dtype))
+    decoded_tensor = torch.from_numpy(array.reshape(shape))
+
+    return decoded_tensor if rows is None else decoded_tensor[rows[0] : rows[1]]
+
+
+def layer_ranks(rank: int, num_layers: int) -> list[int]:
+    """The number of leading components of a factor within the first 1, ..., `num_layers`
+    layers. Each layer about doubles the rank of the previous ones.
+
+    Args:
+        rank (int): The rank of the factor.
+        num_layers (int): The number of layers.
+
+    Returns:
+        list[int]: The cumulative rank of each layer.
+    """
+
+    return [math.ceil(rank / 2 ** (num_layers - k)) for k in range(1, num_layers + 1)]
+
+
+def encode_layers(
+    factors: Sequence[torch.Tensor],
+    num_layers: int = 1,
+    block_rows: Optional[Sequence[Optional[int]]] = None,
+    **kwargs,
+) -> list[bytes]:
+    """Encode the factors of an image into rank-ordered layers.
+
+    Layer k holds the components of every factor that `layer_ranks` assigns to it, so
+    any leading run of layers is a lower-rank version of the image. A single layer is
+    just the factors, one after the other.
+
+    Args:
+        factors (Sequence[torch.Tensor]): The factors (u, v) of each channel, with the
+            components along their last dimension.
+        num_layers (int, optional): The number of layers (default: 1).
+        block_rows (Sequence[int], optional): The `block_rows` of each factor for
+            `encode_tensor` (default: None).
+        **kwargs: Additional keyword arguments for `encode_tensor`.
+
+    Returns:
+        list[bytes]: The encoded layers.
+    """
+
+    assert num_layers >= 1, "'num_layers' must be positive."
+
+    ends = [[0, *layer_ranks(f.shape[-1], num_layers)] for f in factors]
+    block_rows = [None] * len(factors) if block_rows is None else block_rows
+    parts = [
+        (f[..., e[k] : e[k + 1]].contiguous(), b)
+        for k in range(num_layers)
+        for f, e, b in zip(factors, ends, block_rows)
+    ]
+    encoded_parts = _map(
+        lambda part: encode_tensor(part[0], block_rows=part[1], **kwargs),
+        parts,
+        kwargs.get("executor"),
+    )
+    return [
+        combine_bytes(encoded_parts[k * len(factors) : (k + 1) * len(factors)])
+        for k in range(num_layers)
+    ]
+
+
+def _factor_ranks(
+    color_space: str, max_rank: Optional[int | tuple[int, int, int]]
+) -> list[Optional[int]]:
+    """The maximum rank of each factor (u, v) of each channel, see `decode_layers`."""
+
+    if color_space == "RGB":
+        max_ranks = [max_rank]
+    elif max_rank is None or isinstance(max_rank, Sequence):
+        max_ranks = [None] * 3 if max_rank is None else list(max_rank)
+    else:
+        max_ranks = [max_rank, max(max_rank // 2, 1), max(max_rank // 2, 1)]
+    return [r for r in max_ranks for _ in range(2)]
+
+
+def decode_factor(
+    layers: Sequence[bytes],
+    index: int,
+    num_factors: int,
+    max_rank: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    rows: Optional[tuple[int, int]] = None,
+) -> torch.Tensor:
+    """Decode one factor of an image from (some of) its layers.
+
+    Args:
+        layers (Sequence[bytes]): The leading layers written by `encode_layers`.
+        index (int): The index of the factor, i.e., 2 * c for u and 2 * c + 1 for v of
+            channel c.
+        num_factors (int): The number of factors per layer.
+        max_rank (int, optional): Only decode up to this many components (default: None).
+        executor (Executor, optional): The executor that decompresses the fibers of the
+            factor, or None to decompress them in the calling thread (default: None).
+        rows (tuple[int, int], optional): The rows [start, stop) to decode, or None for
+            all of them (default: None).
+
+    Returns:
+        torch.Tensor: The factor.
+    """
+
+    parts, rank = [], 0
+    for layer in layers:
+        if max_rank is not None and rank >= max_rank:
+            break
+        part = decode_tensor(
+            separate_bytes(layer, num_factors)[index],
+            rows=rows,
+            num_fibers=None if max_rank is None else max_rank - rank,
+            executor=executor,
+        )
+        parts.append(part)
+        rank += part.shape[-1]
+
+    factor = (
+        parts[0] if len(parts) == 1 else torch.cat([p for p in parts if p.numel()], -1)
     )
+    return factor[..., :max_rank]
+
+
+def decode_layers(
+    layers: Sequence[bytes],
+    color_space: str,
+    max_rank: Optional[int | tuple[int, int, int]] = None,
+    executor: Optional[Executor] = None,
+    rows: Optional[Sequence[Optional[tuple[int, int]]]] = None,
+) -> list[torch.Tensor]:
+    """Decode the factors of an image from (some of) its layers.
+
+    Args:
+        layers (Sequence[bytes]): The leading layers written by `encode_layers`.
+        color_space (str): The color space of the image, 'RGB' or 'YCbCr'.
+        max_rank (int or tuple[int, int, int], optional): Only decode up to this many
+            components per channel. For YCbCr, an integer is the luma rank and half of it
+            the chroma rank, as in the encoders (default: None).
+        executor (Executor, optional): The executor that decodes the factors and
+            decompresses their fibers, or None to do both in the calling thread
+            (default: None).
+        rows (Sequence[tuple[int, int]], optional): The rows [start, stop) to decode of
+            each factor, or None for all of them (default: None).
+
+    Returns:
+        list[torch.Tensor]: The factors (u, v) of each channel.
+    """
+
+    max_ranks = _factor_ranks(color_space, max_rank)
+    return _map(
+        lambda i: decode_factor(
+            layers,
+            i,
+            len(max_ranks),
+            max_ranks[i],
+            executor,
+            None if rows is None else rows[i],
+        ),
+        range(len(max_ranks)),
+        executor,
+    )
+
+
+def tensor_block_rows(encoded_tensor: bytes) -> Optional[int]:
+    """The number of rows per block of a tensor encoded with `block_rows`, else None.
+
+    Args:
+        encoded_tensor (bytes): The encoded tensor, e.g., from `encode_tensor`.
+
+    Returns:
+        int: The number of rows per block, or None.
+    """
+
+    encoded_metadata = separate_bytes(encoded_tensor)[0]
+    if encoded_metadata[0] != _BLOCKS_TAG:
+        return None
+    return _BLOCKS_HEADER.unpack_from(encoded_metadata)[2]
+
+
+def reconstruct_image_pipelined(
+    layers: Sequence[bytes],
+    metadata: dict,
+    out: Optional[torch.Tensor],
+    workspace: DecodeWorkspace,
+    max_rank: Optional[int | tuple[int, int, int]] = None,
+    num_workers: int = 2,
+    strip_height: int = 64,
+) -> torch.Tensor:
+    """Decode and reconstruct a patch-encoded image with entropy decoding and
+    reconstruction overlapped.
+
+    The v factors and the u factors, in blocks of rows if the image was encoded with
+    `block_rows` (see `encode_layers`), are decompressed by a pool of threads, in the
+    order in which the strips of the image need them. Meanwhile, the calling thread
+    reconstructs each strip (see `reconstruct_image_into`) as soon as the rows of u
+    covering it are decoded. The result equals that of `decode_layers`, followed by
+    `dpcm_decode_factors` and `reconstruct_image_into`.
+
+    Args:
+        layers (Sequence[bytes]): The leading layers written by `encode_layers`.
+        metadata (dict): The metadata of the image (see `image_header_to_bytes`).
+        out (torch.Tensor): The output tensor of shape (C, H, W), or None to allocate
+            one of the dtype of the image.
+        workspace (DecodeWorkspace): The workspace.
+        max_rank (int or tuple[int, int, int], optional): Only decode up to this many
+            components per channel, see `decode_layers` (default: None).
+        num_workers (int, optional): The number of decoding threads (default: 2).
+        strip_height (int, optional): The number of output rows per strip (default: 64).
+
+    Returns:
+        torch.Tensor: The image, i.e., `out` if given.
+    """
+
+    color_space = metadata["color space"]
+    p, q = metadata["patch size"]
+    original_sizes = _per_channel(metadata["original size"], color_space)
+    padded_sizes = _per_channel(metadata["padded size"], color_space)
+    grid_sizes = [(h // p, w // q) for h, w in padded_sizes]
+    max_ranks = _factor_ranks(color_space, max_rank)
+    num_factors = len(max_ranks)
+    H = original_sizes[0][0]
+
+    if "prediction" in metadata:
+        modes = metadata["prediction"]
+        modes = [modes] if color_space == "RGB" else modes
+
+    def decode_v(c):
+        return decode_factor(layers, 2 * c + 1, num_factors, max_ranks[2 * c + 1]).float()
+
+    def decode_u(c, rows):
+        u = decode_factor(layers, 2 * c, num_factors, max_ranks[2 * c], rows=rows)
+        if "prediction" in metadata:
+            u = dpcm_decode(u, grid_sizes[c], modes[c][: u.shape[-1]])
+        return u.float()
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        vs = [pool.submit(decode_v, c) for c in range(len(grid_sizes))]
+
+        # the rows of u in blocks, except for predicted u factors, which are decoded whole
+        chunks = []
+        for c, (grid_h, grid_w) in enumerate(grid_sizes):
+            num_rows = grid_h * grid_w
+            step = tensor_block_rows(separate_bytes(layers[0], num_factors)[2 * c])
+            step = num_rows if step is None or "prediction" in metadata else step
+            for start in range(0, num_rows, step):
+                chunks.append((start / num_rows, c, start, min(start + step, num_rows)))
+        futures = [[] for _ in grid_sizes]
+        for _, c, start, stop in sorted(chunks):
+            futures[c].append((start, stop, pool.submit(decode_u, c, (start, stop))))
+
+        factors = [None] * num_factors
+        for top in range(0, H, strip_height):
+            bottom = min(top + strip_height, H)
+            for c, (h, _) in enumerate(original_sizes):
+                # wait for the blocks of u up to the last row of patches of the strip
+                y = workspace.nearest_index(h, H)[bottom - 1].item() if c else bottom - 1
+                y += (padded_sizes[c][0] - h) // 2
+                grid_h, grid_w = grid_sizes[c]
+                while futures[c] and futures[c][0][0] < (y // p + 1) * grid_w:
+                    start, stop, future = futures[c].pop(0)
+                    u = future.result()
+                    if factors[2 * c] is None:
+                        factors[2 * c] = torch.empty(grid_h * grid_w, u.shape[-1])
+                        factors[2 * c + 1] = vs[c].result()
+                    factors[2 * c][start:stop] = u
+
+            if out is None:
+                num_channels = 3 if color_space == "YCbCr" else len(factors[1]) // (p * q)
+                dtype = getattr(torch, metadata["dtype"])
+                out = torch.empty((num_channels, *original_sizes[0]), dtype=dtype)
+            reconstruct_image_into(
+                factors,
+                metadata,
+                out,
+                workspace,
+                strip_height=strip_height,
+                rows=(top, bottom),
+            )
+
+    return out
+
+
+def load(path: str | os.PathLike) -> memoryview:
+    """Memory-map an encoded image file for decoding.
+
+    The returned read-only view can be passed to the decoders (e.g., `imf_decode`) in
+    place of bytes. Its sections are views into the mapped file, so only the
+    decompressed factors are allocated.
+
+    Args:
+        path (str | os.PathLike): The path of the encoded image file.
+
+    Returns:
+        memoryview: A view of the mapped file, which stays mapped while any view of it
+            is alive.
+    """
+
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-    return decoded_tensor
+    return memoryview(mapped)
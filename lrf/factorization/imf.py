@@ -1,14 +1,128 @@
 import math
-from typing import Optional, Callable
+import warnings
+from typing import Optional, Callable, Iterable, Iterator, Sequence
 
+import numpy as np
 import torch
 from torch import Tensor
 from torch import nn
+import torch.nn.functional as F
 from torch.nn.modules.utils import _pair
 
 from lrf.factorization.utils import relative_error, safe_divide, soft_thresholding
 
 
+class ChunkedMatrix:
+    """An M × N matrix that is only ever read in blocks of rows.
+
+    Provides the operations IMF needs from X: X @ V, X.T @ U, row sums, the norm and a
+    truncated SVD. Each operation streams the row blocks once, so only one block of X
+    is in memory at a time, next to the factors and Gram matrices. Blocks are
+    converted to float32 as they are read.
+
+    Args:
+        source: Either an array-like of shape (M, N) that supports row slicing, such as
+            a numpy memmap or a Tensor, or a callable that returns a fresh iterable of
+            row blocks (e.g., a generator function) on each call. A plain generator
+            cannot be used, since IMF passes over X several times per iteration.
+        chunk_size (int, optional): The number of rows per block for an array-like
+            source (default: 65536).
+        shape (tuple[int, int], optional): The shape of X for a callable source. If not
+            given, it is found with an extra pass over the blocks.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], Iterable] | np.ndarray | Tensor,
+        chunk_size: int = 65536,
+        shape: Optional[tuple[int, int]] = None,
+    ) -> None:
+        self.source = source
+        self.chunk_size = chunk_size
+        if shape is None and callable(source):
+            M, N = 0, None
+            for block in source():
+                M, N = M + block.shape[0], block.shape[1]
+            shape = (M, N)
+        self.shape = torch.Size(source.shape if shape is None else shape)
+        assert len(self.shape) == 2, "Only a single matrix is supported."
+
+    def chunks(self) -> Iterator[tuple[int, Tensor]]:
+        """Yield the start row and the float32 values of each row block."""
+        if callable(self.source):
+            blocks = self.source()
+        else:
+            M, step = self.shape[0], self.chunk_size
+            blocks = (self.source[i : i + step] for i in range(0, M, step))
+
+        start = 0
+        for block in blocks:
+            if isinstance(block, Tensor):
+                block = block.float()
+            else:
+                block = torch.from_numpy(np.array(block, dtype=np.float32))
+            yield start, block
+            start += block.shape[0]
+
+    @property
+    def mT(self) -> "_TransposedChunkedMatrix":
+        return _TransposedChunkedMatrix(self)
+
+    def float(self) -> "ChunkedMatrix":
+        return self
+
+    def __matmul__(self, v: Tensor) -> Tensor:
+        return torch.cat([block @ v for _, block in self.chunks()], dim=-2)
+
+    def sum(self, dim: int = -1) -> Tensor:
+        assert dim in (-1, 1), "Only row sums are supported."
+        return torch.cat([block.sum(dim=-1) for _, block in self.chunks()])
+
+    def norm_and_sum(self) -> tuple[Tensor, Tensor]:
+        """The Frobenius norm and the sum of X in float64, from a single pass."""
+        norm_sq = sum_x = torch.zeros((), dtype=torch.float64)
+        for _, block in self.chunks():
+            norm_sq = (
+                norm_sq + torch.linalg.vector_norm(block, dim=-1).double().square().sum()
+            )
+            sum_x = sum_x + block.sum(dim=-1).double().sum()
+        return norm_sq.sqrt(), sum_x
+
+    def svd(self, rank: int) -> tuple[Tensor, Tensor, Tensor]:
+        """The truncated SVD of X, from the eigendecomposition of X.T @ X (in float64).
+
+        Returns u, s, vh with the top `rank` singular values in descending order, like
+        `torch.linalg.svd(x, full_matrices=False)` truncated to `rank`.
+        """
+        N = self.shape[1]
+        gram = torch.zeros(N, N, dtype=torch.float64)
+        for _, block in self.chunks():
+            block = block.double()
+            gram += block.mT @ block
+        eigvals, eigvecs = torch.linalg.eigh(gram)
+        s = eigvals.flip(-1)[:rank].clamp(min=0).sqrt()
+        v = eigvecs.flip(-1)[:, :rank].float()
+        u = safe_divide(self @ v, s.float())
+        return u, s.float(), v.mT
+
+
+class _TransposedChunkedMatrix:
+    "The transpose of a `ChunkedMatrix`, for X.T @ U."
+
+    def __init__(self, x: ChunkedMatrix) -> None:
+        self.mT = x
+        self.shape = torch.Size(reversed(x.shape))
+
+    def float(self) -> "_TransposedChunkedMatrix":
+        return self
+
+    def __matmul__(self, u: Tensor) -> Tensor:
+        out = u.new_zeros(self.shape[0], u.shape[-1])
+        for start, block in self.mT.chunks():
+            out += block.mT @ u[start : start + block.shape[0]]
+        return out
+
+
 class RandInit(nn.Module):
     def __init__(
         self,
@@ -24,8 +138,8 @@ class RandInit(nn.Module):
         u_shape = (*x.shape[:-2], M, R)
         v_shape = (*x.shape[:-2], N, R)
         alpha, beta = self.bounds
-        u = torch.randint(alpha, beta + 1, (M, R)).expand(u_shape).float()
-        v = torch.randint(alpha, beta + 1, (N, R)).expand(v_shape).float()
+        u = torch.randint(alpha, beta + 1, u_shape).float()
+        v = torch.randint(alpha, beta + 1, v_shape).float()
         return u, v
 
 
@@ -41,7 +155,10 @@ class SVDInit(nn.Module):
 
     def forward(self, x: Tensor) -> tuple[Tensor, Tensor]:
         R = min(self.rank, *x.shape[-2:])
-        u, s, v = torch.linalg.svd(x, full_matrices=False)
+        if isinstance(x, ChunkedMatrix):
+            u, s, v = x.svd(R)
+        else:
+            u, s, v = torch.linalg.svd(x, full_matrices=False)
         u, s, v = u[..., :, :R], s[..., :R], v[..., :R, :]
         s = torch.sqrt(s)
         u = torch.einsum("...ir, ...r -> ...ir", u, s)
@@ -51,7 +168,8 @@ class SVDInit(nn.Module):
             u = torch.nn.functional.pad(u, (0, self.rank - R))
             v = torch.nn.functional.pad(v, (0, self.rank - R))
 
-        w0, w1 = torch.zeros_like(x[..., 0:1, 0:1]), torch.ones_like(x[..., 0:1, 0:1])
+        w0 = u.new_zeros((*u.shape[:-2], 1, 1))
+        w1 = torch.ones_like(w0)
 
         if self.num_levels:
             scale_u = (
@@ -80,6 +198,9 @@ class CoordinateDescent(nn.Module):
         project: Optional[Callable | tuple[Callable, Callable]] = None,
         l2: float | tuple[float, float] = 0,
         l1_ratio: float = 0,
+        block_size: Optional[int] = None,
+        damping: float = 1,
+        compile: bool = False,
         eps: float = 1e-16,
     ):
         super().__init__()
@@ -88,6 +209,10 @@ class CoordinateDescent(nn.Module):
         self.project = _pair(project)
         self.l2 = _pair(l2)
         self.l1_ratio = l1_ratio
+        self.block_size = block_size  # columns solved jointly (Jacobi-style) per step
+        self.damping = damping  # step length of the block updates
+        self.compile = compile  # run the column sweep through torch.compile
+        self._compiled_sweep = None
         self.eps = eps  # avoids division by zero
 
     def update_u(
@@ -99,24 +224,21 @@ class CoordinateDescent(nn.Module):
         l1: float,
         l2: float,
         project: Callable,
+        xv: Optional[Tensor] = None,
     ) -> Tensor:
         # x ≈ w0 + w1 * u @ v.t --> u = ?
+        # w0 and w1 are folded into x @ v, so (x - w0) / w1 is never formed
         w0, w1 = w.split(split_size=1, dim=-2)
-        x = safe_divide(x - w0, w1, self.eps)
+        xv = x @ v if xv is None else xv
         R = u.shape[-1]
-        a, b = x @ v, v.mT @ v
-        if R > 1:
-            u_new = u.clone()
-            for r in range(R):
-                indices = [j for j in range(R) if j != r]
-                term1 = a[..., r : (r + 1)]
-                uu = u_new[..., indices]
-                bb = b[..., indices, r : (r + 1)]
-                term2 = uu @ bb
-                numerator = soft_thresholding(term1 - term2, l1)
-                denominator = b[..., r : (r + 1), r : (r + 1)] + l2
-                ur_new = (numerator + self.eps) / (denominator + self.eps)
-                u_new[..., r : (r + 1)] = project(ur_new)
+        a = safe_divide(xv - w0 * v.sum(dim=-2, keepdim=True), w1, self.eps)
+        b = v.mT @ v
+        if R > 1 and self.block_size is not None:
+            u_new = self.block_sweep(u, a, b, l1, l2, project)
+        elif R > 1 and self.compile:
+            u_new = self.compiled_sweep(u, a, b, l1, l2, project)
+        elif R > 1:
+            u_new = self.sweep(u, a, b, l1, l2, project)
         else:
             numerator = soft_thresholding(a, l1)
             denominator = b + l2
@@ -125,6 +247,92 @@ class CoordinateDescent(nn.Module):
 
         return u_new
 
+    def sweep(
+        self, u: Tensor, a: Tensor, b: Tensor, l1: float, l2: float, project: Callable
+    ) -> Tensor:
+        """Update the columns of u one at a time (Gauss-Seidel)."""
+
+        R = u.shape[-1]
+        u_new = u.clone()
+        # running product u_new @ b, kept in sync by rank-1 corrections
+        c = u_new @ b
+        for r in range(R):
+            ur = u_new[..., r : (r + 1)]
+            b_r = b[..., r : (r + 1), :]
+            b_rr = b[..., r : (r + 1), r : (r + 1)]
+            term1 = a[..., r : (r + 1)]
+            # u_new[..., ≠r] @ b[..., ≠r, r], read off the running product
+            term2 = c[..., r : (r + 1)] - ur * b_rr
+            numerator = soft_thresholding(term1 - term2, l1)
+            denominator = b_rr + l2
+            ur_new = (numerator + self.eps) / (denominator + self.eps)
+            ur_new = project(ur_new)
+            c.addcmul_(ur_new - ur, b_r)
+            ur.copy_(ur_new)
+
+        return u_new
+
+    def compiled_sweep(
+        self, u: Tensor, a: Tensor, b: Tensor, l1: float, l2: float, project: Callable
+    ) -> Tensor:
+        """`sweep` compiled with `torch.compile` into a single kernel graph.
+
+        Falls back to the eager `sweep` (with a warning) if compilation is unavailable
+        or fails, e.g., without a C++ compiler.
+        """
+
+        try:
+            if self._compiled_sweep is None:
+                self._compiled_sweep = torch.compile(self.sweep, dynamic=True)
+            return self._compiled_sweep(u, a, b, l1, l2, project)
+        except Exception as e:
+            warnings.warn(f"Compiling the IMF sweep failed, using eager mode: {e}")
+            self.compile = False
+            return self.sweep(u, a, b, l1, l2, project)
+
+    def block_sweep(
+        self, u: Tensor, a: Tensor, b: Tensor, l1: float, l2: float, project: Callable
+    ) -> Tensor:
+        """Update the columns of u in blocks of `block_size`, each solved jointly.
+
+        Each block solves its least squares problem (the others being fixed) with one
+        BLAS-3 solve, moves `damping` of the way towards the solution and projects it.
+        Since the rows of u are decoupled, the new block is kept only in the rows where
+        it does not increase the objective, so the loss never goes up.
+        """
+
+        R = u.shape[-1]
+        u_new = u.clone()
+        # running product u_new @ b, kept in sync by low-rank corrections
+        c = u_new @ b
+        for start in range(0, R, self.block_size):
+            block = slice(start, min(start + self.block_size, R))
+            uj = u_new[..., block]
+            bj = b[..., block, :]
+            eye = torch.eye(uj.shape[-1], dtype=b.dtype, device=b.device)
+            bjj = b[..., block, block] + l2 * eye
+            # a - (u_new @ b without the block's own contribution)
+            target = a[..., block] - c[..., block] + uj @ b[..., block, block]
+            # a small relative ridge keeps the Cholesky factorization from failing on
+            # (nearly) singular blocks; NaNs from a failure are rejected further below
+            ridge = 1e-6 * bjj.diagonal(dim1=-2, dim2=-1).mean(-1) + self.eps
+            L, _ = torch.linalg.cholesky_ex(bjj + ridge[..., None, None] * eye)
+            uj_opt = torch.cholesky_solve(soft_thresholding(target, l1).mT, L).mT
+            uj_new = project(uj + self.damping * (uj_opt - uj))
+            uj_old = project(uj)  # feasible fallback (= uj after the first iteration)
+
+            # safeguard: objective 0.5 x bjj x.t - target x.t + l1 |x|, per row
+            def objective(x: Tensor) -> Tensor:
+                out = ((0.5 * x @ bjj - target) * x).sum(dim=-1)
+                return out + l1 * x.abs().sum(dim=-1) if l1 else out
+
+            accept = (objective(uj_new) <= objective(uj_old)).unsqueeze(-1)
+            uj_new = torch.where(accept, uj_new, uj_old)
+            c += (uj_new - uj) @ bj
+            uj.copy_(uj_new)
+
+        return u_new
+
     def update_v(
         self,
         x: Tensor,
@@ -134,21 +342,46 @@ class CoordinateDescent(nn.Module):
         l1: float,
         l2: float,
         project: Callable,
+        xu: Optional[Tensor] = None,
     ) -> Tensor:
         # x ≈ w0 + w1 * u @ v.t --> v = ?
-        return self.update_u(x.mT, v, u, w, l1, l2, project)
+        return self.update_u(x.mT, v, u, w, l1, l2, project, xv=xu)
 
-    def update_w(self, x: Tensor, u: Tensor, v: Tensor, w: Tensor) -> Tensor:
+    def update_w(
+        self,
+        x: Tensor,
+        u: Tensor,
+        v: Tensor,
+        w: Tensor,
+        xu: Optional[Tensor] = None,
+        x_sum: Optional[Tensor] = None,
+    ) -> Tensor:
         # x ≈ w0 + w1 * u @ v.t --> w = ?
-        z = (u @ v.mT).flatten(-2, -1).unsqueeze(-1)
-        a = torch.cat([torch.ones_like(z), z], dim=-1)
-        b = x.flatten(-2, -1).unsqueeze(-1)
-        w = torch.linalg.lstsq(a, b, rcond=1e-16).solution
+        # normal equations of the 2 × 2 least squares problem in (w0, w1),
+        # with all sums over z = u @ v.t expressed through u, v and x.t @ u
+        xu = x.mT @ u if xu is None else xu
+        n, dtype = x.shape[-2] * x.shape[-1], u.dtype
+        u, v, xu = u.double(), v.double(), xu.double()
+        sum_x = x.sum(dim=-1).double().sum(dim=-1) if x_sum is None else x_sum
+        sum_z = (u.sum(dim=-2) * v.sum(dim=-2)).sum(dim=-1)
+        sum_zz = ((u.mT @ u) * (v.mT @ v)).sum(dim=(-2, -1))
+        sum_xz = (v * xu).sum(dim=(-2, -1))
+        det = n * sum_zz - sum_z**2
+        w1 = safe_divide(n * sum_xz - sum_x * sum_z, det, self.eps)
+        w0 = (sum_x - w1 * sum_z) / n
+        w = torch.stack([w0, w1], dim=-1).unsqueeze(-1).to(dtype)
         return w
 
-    def forward(
-        self, x: Tensor, factors: tuple[Tensor, Tensor, Tensor]
-    ) -> tuple[Tensor, Tensor]:
+    def step(
+        self,
+        x: Tensor,
+        factors: tuple[Tensor, Tensor, Tensor],
+        x_sum: Optional[Tensor] = None,
+    ) -> tuple[tuple[Tensor, Tensor, Tensor], Optional[Tensor]]:
+        """Run one sweep and also return x.t @ u for the updated u, if computed.
+
+        The sum of the entries of x, if given, saves a pass over x in the update of w.
+        """
         u, v, w = factors
         *_, M, N = x.shape
         l1_u = self.l2[0] * self.l1_ratio * N
@@ -157,11 +390,18 @@ class CoordinateDescent(nn.Module):
         l2_v = self.l2[1] * (1 - self.l1_ratio) * M
         if 0 in self.factor:
             u = self.update_u(x, u, v, w, l1_u, l2_u, self.project[0])
+        xu = x.mT @ u if (1 in self.factor or 2 in self.factor) else None
         if 1 in self.factor:
-            v = self.update_v(x, u, v, w, l1_v, l2_v, self.project[1])
+            v = self.update_v(x, u, v, w, l1_v, l2_v, self.project[1], xu=xu)
         if 2 in self.factor:
-            w = self.update_w(x, u, v, w)
-        return u, v, w
+            w = self.update_w(x, u, v, w, xu=xu, x_sum=x_sum)
+        return (u, v, w), xu
+
+    def forward(
+        self, x: Tensor, factors: tuple[Tensor, Tensor, Tensor]
+    ) -> tuple[Tensor, Tensor]:
+        factors, _ = self.step(x, factors)
+        return factors
 
 
 class IMF(nn.Module):
@@ -177,6 +417,8 @@ class IMF(nn.Module):
         num_iters: int = 10,
         bounds: tuple[None | float, None | float] = (None, None),
         num_levels: Optional[float] = None,
+        tol: Optional[float] = None,
+        patience: int = 1,
         verbose: bool = False,
         **kwargs,
     ) -> None:
@@ -184,6 +426,8 @@ class IMF(nn.Module):
         self.rank = rank
         self.num_iters = num_iters
         self.bounds = tuple(bounds)
+        self.tol = tol  # stop once the relative loss decrease is at most tol ...
+        self.patience = patience  # ... for this many consecutive iterations
         self.init = SVDInit(rank=rank, num_levels=num_levels)
         self.solver = CoordinateDescent(project=self._project, **kwargs)
         self.verbose = verbose
@@ -194,25 +438,109 @@ class IMF(nn.Module):
             x = torch.clamp(x, math.ceil(self.bounds[0]), math.floor(self.bounds[1]))
         return x
 
-    def decompose(self, x: Tensor, *args, **kwargs) -> tuple[Tensor, Tensor]:
-        # x: B × M × N
+    def decompose(
+        self,
+        x: Tensor | ChunkedMatrix,
+        *args,
+        factors: Optional[tuple[Tensor, Tensor, Tensor]] = None,
+        return_losses: bool = False,
+        **kwargs,
+    ) -> tuple[Tensor, Tensor, Tensor] | tuple[Tensor, Tensor, Tensor, Tensor]:
+        # x: B × M × N, or an M × N ChunkedMatrix that is streamed in row blocks
 
         # convert x to float
         x = x.float()
 
-        # initialize
-        u, v, w = self.init(x)
+        # initialize, unless warm-started from given factors
+        u, v, w = self.init(x) if factors is None else factors
+
+        # the loss is only computed if it is used
+        compute_loss = return_losses or self.verbose or self.tol is not None
+
+        # norm and sum of x, so that the loss never needs a reconstruction
+        # (row-wise in float32, then accumulated in float64 for accuracy)
+        if isinstance(x, ChunkedMatrix):
+            x_norm, x_sum = x.norm_and_sum()
+        else:
+            if compute_loss:
+                x_norm = torch.linalg.vector_norm(x, dim=-1).double().square()
+                x_norm = x_norm.sum(-1).sqrt()
+            x_sum = x.sum(dim=-1).double().sum(dim=-1)
 
         # iterate
+        losses, num_stalls = [], 0
         for it in range(1, self.num_iters + 1):
+            (u, v, w), xu = self.solver.step(x, [u, v, w], *args, x_sum=x_sum, **kwargs)
+            if not compute_loss:
+                continue
+
+            xu = x.mT @ u if xu is None else xu
+            loss = self.gram_loss(x_norm, x_sum, xu, u, v, w)
             if self.verbose:
-                loss = self.loss(x, u, v, w)
                 print(f"iter {it}: loss = {loss}")
 
-            u, v, w = self.solver(x, [u, v, w], *args, **kwargs)
+            if self.tol is not None and losses:
+                decrease = (losses[-1] - loss) / (losses[-1] + self.solver.eps)
+                num_stalls = num_stalls + 1 if torch.all(decrease <= self.tol) else 0
+
+            losses.append(loss)
+
+            if num_stalls >= self.patience:
+                break
+
+        if return_losses:
+            losses = (
+                torch.stack(losses) if losses else x_norm.new_empty((0, *x_norm.shape))
+            )
+            return u, v, w, losses
 
         return u, v, w
 
+    def decompose_nested(
+        self,
+        x: Tensor,
+        ranks: Sequence[int],
+        *args,
+        return_losses: bool = False,
+        **kwargs,
+    ) -> (
+        list[tuple[Tensor, Tensor, Tensor]] | list[tuple[Tensor, Tensor, Tensor, Tensor]]
+    ):
+        """Factorize x at several ranks in one run, growing the rank step by step.
+
+        The SVD initialization is computed once, at the largest rank. Each rank is then
+        warm-started from the integer factors of the previous (smaller) rank, extended by
+        the next SVD-initialized columns, and refined with `decompose`. With a `tol`,
+        the refinement of each rank usually stops after a few iterations.
+
+        Args:
+            x (Tensor): The matrices to factorize, of shape (..., M, N).
+            ranks (Sequence[int]): The ranks; `self.rank` is ignored.
+            return_losses (bool, optional): Whether to also return the loss history of
+                each rank (default: False).
+
+        Returns:
+            list[tuple[Tensor, Tensor, Tensor]]: The factors u, v, w (and the loss history,
+                if `return_losses`) for each rank, in the order of `ranks`.
+        """
+
+        x = x.float()
+        steps = sorted(set(ranks))
+        init = SVDInit(rank=steps[-1], num_levels=self.init.num_levels)
+        u_init, v_init, w = init(x)
+        u, v = u_init[..., :0], v_init[..., :0]
+
+        outputs = {}
+        for R in steps:
+            u = torch.cat([u, u_init[..., u.shape[-1] : R]], dim=-1)
+            v = torch.cat([v, v_init[..., v.shape[-1] : R]], dim=-1)
+            outputs[R] = self.decompose(
+                x, *args, factors=(u, v, w), return_losses=return_losses, **kwargs
+            )
+            u, v, w = outputs[R][:3]
+
+        return [outputs[R] for R in ranks]
+
     @staticmethod
     def reconstruct(u: Tensor, v: Tensor, w: Optional[Tensor] = None) -> Tensor:
         out = u @ v.mT
@@ -226,6 +554,130 @@ class IMF(nn.Module):
     def loss(x: Tensor, u: Tensor, v: Tensor, w: Optional[Tensor] = None) -> Tensor:
         return relative_error(x, IMF.reconstruct(u, v, w))
 
+    @staticmethod
+    def gram_loss(
+        x_norm: Tensor,
+        x_sum: Tensor,
+        xu: Tensor,
+        u: Tensor,
+        v: Tensor,
+        w: Optional[Tensor] = None,
+        eps: float = 1e-16,
+    ) -> Tensor:
+        """Relative error of the factorization, computed from Gram-matrix traces.
+
+        Expands ‖X − w0 − w1 * U @ V.T‖² into ‖X‖², sum(X), tr(U.T @ X @ V)
+        and tr(U.T @ U @ V.T @ V), so X is never reconstructed.
+
+        Args:
+            x_norm (Tensor): The Frobenius norm of X, ‖X‖.
+            x_sum (Tensor): The sum of the entries of X.
+            xu (Tensor): The product X.T @ U.
+            u (Tensor): The U factor.
+            v (Tensor): The V factor.
+            w (Tensor, optional): The offset and scale (w0, w1) (default: None).
+            eps (float, optional): Avoids division by zero (default: 1e-16).
+
+        Returns:
+            Tensor: The relative error ‖X − X̂‖ / ‖X‖, same as `IMF.loss`.
+        """
+
+        n = u.shape[-2] * v.shape[-2]
+        u, v, xu = u.double(), v.double(), xu.double()
+        if w is None:
+            w0, w1 = 0, 1
+        else:
+            w0, w1 = w.double().squeeze(-1).unbind(dim=-1)
+
+        sum_z = (u.sum(dim=-2) * v.sum(dim=-2)).sum(dim=-1)
+        sum_zz = ((u.mT @ u) * (v.mT @ v)).sum(dim=(-2, -1))
+        sum_xz = (v * xu).sum(dim=(-2, -1))
+        error = (
+            x_norm**2
+            - 2 * w0 * x_sum
+            - 2 * w1 * sum_xz
+            + n * w0**2
+            + 2 * w0 * w1 * sum_z
+            + w1**2 * sum_zz
+        )
+        return torch.sqrt(error.clamp(min=0)) / (x_norm + eps)
+
     def forward(self, x: Tensor) -> Tensor:
         u, v, w = self.decompose(x)
         return self.reconstruct(u, v, w)
+
+
+def bucketed_imf(
+    matrices: Sequence[Tensor],
+    ranks: Sequence[int],
+    return_losses: bool = True,
+    **kwargs,
+) -> list[tuple[Tensor, Tensor, Tensor, Tensor]] | list[tuple[Tensor, Tensor, Tensor]]:
+    """Factorize matrices of different shapes and ranks with few batched IMF calls.
+
+    The matrices are bucketed by rank and shape, and each bucket is factorized by a
+    single call to `IMF.decompose`. When the scale and offset w are kept fixed at their
+    initial values (w0 = 0, w1 = 1), zero rows of U do not change V or the loss, so
+    matrices that differ only in their number of rows are padded with zero rows and
+    share a bucket. Each matrix is initialized at its own size, and the padded rows of
+    U are kept at zero by masking them in every update of U, since the update alone
+    would set them to 1 in any zero column of V, e.g., when the rank exceeds the rank
+    of X.
+
+    Args:
+        matrices (Sequence[Tensor]): The matrices to factorize, each of shape (..., M, N).
+        ranks (Sequence[int]): The rank of each matrix.
+        return_losses (bool, optional): Whether to also return the loss history of each
+            matrix (default: True).
+        **kwargs: Additional arguments for `IMF`.
+
+    Returns:
+        list[tuple[Tensor, Tensor, Tensor, Tensor]]: For each matrix, its factors u, v, w
+            and (if `return_losses`) its loss history, as returned by `IMF.decompose`.
+    """
+
+    assert len(matrices) == len(ranks), "Each matrix must have a rank."
+
+    padding = 2 not in kwargs.get("factor", (0, 1, 2)) and not kwargs.get("num_levels")
+
+    buckets = {}
+    for i, (x, R) in enumerate(zip(matrices, ranks)):
+        M, N = x.shape[-2:]
+        key = (N, R) if padding else (M, N, R)
+        buckets.setdefault(key, []).append(i)
+
+    outputs = [None] * len(matrices)
+    for (*_, R), indices in buckets.items():
+        xs = [matrices[i].reshape(-1, *matrices[i].shape[-2:]) for i in indices]
+        M = max(x.shape[-2] for x in xs)
+        x = torch.cat([F.pad(x.float(), (0, 0, 0, M - x.shape[-2])) for x in xs])
+
+        imf = IMF(rank=R, **kwargs)
+        if all(x_.shape[-2] == M for x_ in xs):
+            u, v, w = imf.init(x)
+        else:
+            # the SVD of the padded matrices differs numerically in the null space
+            inits = [imf.init(x_.float()) for x_ in xs]
+            u = torch.cat([F.pad(u_, (0, 0, 0, M - u_.shape[-2])) for u_, _, _ in inits])
+            v, w = (torch.cat([init[k] for init in inits]) for k in (1, 2))
+            num_rows = torch.tensor([x_.shape[-2] for x_ in xs for _ in range(len(x_))])
+            mask = (torch.arange(M) < num_rows[:, None]).unsqueeze(-1).float()
+            project = imf.solver.project[0]
+            imf.solver.project = (lambda u: project(u) * mask, imf.solver.project[1])
+        u, v, w, *losses = imf.decompose(
+            x, factors=(u, v, w), return_losses=return_losses
+        )
+
+        start = 0
+        for i, x in zip(indices, xs):
+            batch_shape, (M, N) = matrices[i].shape[:-2], x.shape[-2:]
+            batch = slice(start, start + len(x))
+            outputs[i] = (
+                u[batch, :M].reshape(*batch_shape, M, R),
+                v[batch].reshape(*batch_shape, N, R),
+                w[batch].reshape(*batch_shape, 2, 1),
+                *(loss[:, batch].reshape(-1, *batch_shape) for loss in losses),
+            )
+            start += len(x)
+
+    return outputs
@@ -30,6 +30,7 @@ setup(
         "singular value decomposition",
     ],
     packages=find_packages(),
+    package_data={"lrf.compression": ["dictionaries/*.zdict"]},
     python_requires=">=3.10",
     install_requires=[
         "numpy",
@@ -1,3 +1,7 @@
+import os
+import tempfile
+
+import numpy as np
 import torch
 from skimage import data
 from matplotlib import pyplot as plt
@@ -57,3 +61,253 @@ ax[1, 3].set_title("Downsampled Image (Cr)")
 ax[1, 3].axis("off")
 
 plt.show()
+
+
+def test_imf_encode_batch():
+    images = torch.randint(0, 256, size=(4, 3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode_batch(images, quality=10)
+    assert len(encoded) == 4
+    assert encoded[1] == lrf.imf_encode(images[1], quality=10)
+    assert lrf.imf_decode(encoded[1]).shape == images[1].shape
+
+
+def test_imf_encode_nested():
+    image = torch.randint(0, 256, size=(3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode_nested(image, quality=[5, 20, 10, 20], tol=1e-3)
+    assert len(encoded) == 4 and encoded[1] == encoded[3]
+    ranks = [lrf.bytes_to_image_header(lrf.separate_bytes(e)[0])["rank"] for e in encoded]
+    assert ranks[0][0] < ranks[2][0] < ranks[1][0]
+    assert lrf.imf_decode(encoded[0]).shape == image.shape
+
+
+def test_imf_decode_integer():
+    image = torch.randint(0, 256, size=(3, 41, 57), dtype=torch.uint8)
+    for color_space in ("RGB", "YCbCr"):
+        encoded = lrf.imf_encode(image, quality=10, color_space=color_space)
+        decoded = lrf.imf_decode(encoded, integer=True)
+        assert decoded.dtype == torch.uint8
+        assert torch.equal(decoded, lrf.imf_decode(encoded))
+        # decoded strip by strip, like the whole image planes of the batch decoder
+        assert torch.equal(decoded, lrf.imf_decode_batch([encoded], integer=True)[0])
+
+
+def test_combine_bytes():
+    payloads = [b"", b"metadata", bytes(range(256)) * 3]
+    combined = lrf.combine_bytes(payloads)
+    assert lrf.is_container(combined)
+    assert lrf.separate_bytes(combined, len(payloads)) == tuple(payloads)
+    # legacy streams, nested by `_combine_bytes`, stay readable
+    legacy = lrf.compression.utils._combine_bytes
+    legacy = legacy(legacy(payloads[0], payloads[1]), payloads[2])
+    assert lrf.separate_bytes(legacy, len(payloads)) == tuple(payloads)
+
+
+def test_load():
+    image = torch.randint(0, 256, size=(3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10, color_space="YCbCr")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "encoded.imf")
+        with open(path, "wb") as f:
+            f.write(encoded)
+        decoded = lrf.imf_decode(lrf.load(path), num_workers=4)
+    assert torch.equal(decoded, lrf.imf_decode(encoded))
+
+
+def test_entropy_coders():
+    data = [bytes([0, 1, 255, 3, 1] * 100), b"", bytes(range(256)) * 4, b"\x05"]
+    for coder in ("zlib", "zlib-1", "lzma", "bz2", "rans"):
+        encoded = lrf.entropy_encode(data, coder)
+        assert lrf.entropy_decode(encoded, coder) == data
+    image = torch.randint(0, 256, size=(3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10, coder="rans", num_workers=2)
+    assert torch.equal(
+        lrf.imf_decode(encoded), lrf.imf_decode(lrf.imf_encode(image, quality=10))
+    )
+
+
+def test_pack_bits():
+    array = np.arange(-16, 16, dtype=np.int8).repeat(3)
+    packed = lrf.pack_bits(array, (-16, 15))
+    assert len(packed) == len(array) * 5 // 8
+    assert np.array_equal(lrf.unpack_bits(packed, (-16, 15), len(array), np.int8), array)
+    image = torch.randint(0, 256, size=(3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10, coder="none", pack=True)
+    assert torch.equal(
+        lrf.imf_decode(encoded), lrf.imf_decode(lrf.imf_encode(image, quality=10))
+    )
+    try:
+        lrf.imf_encode(image, quality=10, bounds=(-(2**15) - 1, 2**15), pack=True)
+        assert False, "Bounds outside int16 must be rejected."
+    except ValueError:
+        pass
+
+
+def test_image_header():
+    metadata = {
+        "dtype": "uint8",
+        "color space": "YCbCr",
+        "patch": True,
+        "bounds": [-16, 15],
+        "patch size": [8, 8],
+        "original size": [[41, 57], [20, 28], [20, 28]],
+        "padded size": [[48, 64], [24, 32], [24, 32]],
+        "rank": [5, 2, 2],
+        "quantization": {"u": [[0.5, -1.0], None, None], "v": [[0.25, -2.0], None, None]},
+    }
+    encoded = lrf.image_header_to_bytes(metadata, "imf")
+    assert lrf.bytes_to_image_header(encoded) == {"codec": "imf", **metadata}
+    assert lrf.bytes_to_image_header(lrf.dict_to_bytes(metadata)) == metadata
+
+
+def test_zlib_dictionary():
+    image = torch.randint(0, 256, (3, 48, 48), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10)
+    encoded_dict = lrf.imf_encode(image, quality=10, dictionary=1)
+    assert len(encoded_dict) < len(encoded)
+    assert torch.equal(lrf.imf_decode(encoded_dict), lrf.imf_decode(encoded))
+    try:
+        lrf.imf_encode(image, quality=10, coder="lzma", dictionary=1)
+        assert False, "A dictionary with a coder other than zlib must be rejected."
+    except AssertionError as e:
+        assert "'dictionary'" in str(e)
+
+
+def test_dpcm():
+    u = torch.randint(-128, 128, (6 * 5, 4), dtype=torch.int8)
+    modes = ["none", "left", "top", "gradient"]
+    residuals = lrf.dpcm_encode(u, (6, 5), modes)
+    assert residuals.dtype == u.dtype
+    assert torch.equal(lrf.dpcm_decode(residuals, (6, 5), modes), u)
+
+    image = torch.randint(0, 256, (3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10)
+    encoded_dpcm = lrf.imf_encode(image, quality=10, prediction=True)
+    assert torch.equal(lrf.imf_decode(encoded_dpcm), lrf.imf_decode(encoded))
+
+
+def test_layers():
+    image = torch.randint(0, 256, (3, 64, 64), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, rank=8, layers=3)
+    assert torch.equal(
+        lrf.imf_decode(encoded), lrf.imf_decode(lrf.imf_encode(image, rank=8))
+    )
+
+    _, layers = lrf.separate_layers(encoded)
+    preview = lrf.imf_decode(encoded, max_bytes=len(encoded) - len(layers[-1]))
+    assert torch.equal(preview, lrf.imf_decode(encoded, max_rank=4))
+
+
+def test_imf_decode_roi():
+    image = torch.randint(0, 256, (3, 75, 90), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10, block_rows=2)
+    for integer in (False, True):
+        decoded = lrf.imf_decode(encoded, integer=integer)
+        roi = lrf.imf_decode(encoded, integer=integer, roi=(13, 21, 30, 41))
+        assert torch.equal(roi, decoded[:, 13:43, 21:62])
+
+
+def test_imf_decode_scale():
+    image = torch.randint(0, 256, (3, 64, 96), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10)
+    decoded = lrf.imf_decode(encoded).float()
+    for scale in (2, 4, 8):
+        thumbnail = lrf.imf_decode(encoded, scale=scale)
+        assert thumbnail.shape == (3, 64 // scale, 96 // scale)
+        y = lrf.rgb_to_ycbcr(thumbnail.float())[0]
+        y_ref = lrf.rgb_to_ycbcr(torch.nn.functional.avg_pool2d(decoded, scale))[0]
+        assert (y - y_ref).abs().mean() < 2
+
+
+def test_imf_decode_batch():
+    images = torch.randint(0, 256, (4, 3, 32, 40), dtype=torch.uint8)
+    encoded_images = lrf.imf_encode_batch(images, quality=10)
+    encoded_images.insert(2, lrf.imf_encode(images[0, :, :24], quality=10))
+    decoded_images = lrf.imf_decode_batch(encoded_images)
+    assert len(decoded_images) == 5
+    for encoded, decoded in zip(encoded_images, decoded_images):
+        assert torch.equal(decoded, lrf.imf_decode(encoded))
+
+    decoded_images = lrf.imf_decode_batch(encoded_images[:2], integer=True)
+    assert decoded_images.shape == (2, 3, 32, 40)
+
+
+def test_decode_out():
+    image = torch.randint(0, 256, (3, 45, 70), dtype=torch.uint8)
+    workspace = lrf.DecodeWorkspace()
+    for encode, decode in (
+        (lrf.imf_encode, lrf.imf_decode),
+        (lrf.svd_encode, lrf.svd_decode),
+    ):
+        encoded = encode(image, quality=10, color_space="YCbCr")
+        frame = np.zeros((45, 70, 3), dtype=np.uint8)  # channels last
+        decode(encoded, out=torch.from_numpy(frame).permute(2, 0, 1), workspace=workspace)
+        assert np.array_equal(frame, decode(encoded).permute(1, 2, 0).numpy())
+
+
+def test_reconstruct_strips():
+    image = torch.randint(0, 256, (3, 45, 70), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10, color_space="YCbCr")
+    encoded_metadata, encoded_layers = lrf.separate_layers(encoded)
+    metadata = lrf.bytes_to_image_header(encoded_metadata)
+    factors = [f.float() for f in lrf.decode_layers(encoded_layers, "YCbCr")]
+    workspace = lrf.DecodeWorkspace()
+    expected = lrf.reconstruct_image_into(
+        factors, metadata, torch.empty_like(image), workspace, strip_height=None
+    )
+    for strip_height in (1, 7, 16):
+        out = lrf.reconstruct_image_into(
+            factors,
+            metadata,
+            torch.empty_like(image),
+            workspace,
+            strip_height=strip_height,
+        )
+        assert torch.equal(out, expected)
+
+
+def test_imf_decode_pipelined():
+    image = torch.randint(0, 256, (3, 45, 70), dtype=torch.uint8)
+    for kwargs in ({}, {"block_rows": 2}, {"block_rows": 3, "prediction": True}):
+        encoded = lrf.imf_encode(image, quality=10, color_space="YCbCr", **kwargs)
+        expected = lrf.imf_decode(encoded)
+        assert torch.equal(lrf.imf_decode(encoded, num_workers=3), expected)
+        out = torch.empty_like(expected)
+        lrf.imf_decode(encoded, num_workers=2, out=out)
+        assert torch.equal(out, expected)
+
+
+def test_imf_rgb_no_patch():
+    image = torch.randint(0, 256, (3, 40, 56), dtype=torch.uint8)
+    encoded = lrf.imf_encode(image, quality=10, color_space="RGB", patch=False)
+    decoded = lrf.imf_decode(encoded)
+    assert decoded.shape == image.shape and decoded.dtype == image.dtype
+    assert torch.equal(lrf.imf_decode(encoded, num_workers=2), decoded)
+    assert torch.equal(
+        lrf.imf_decode(encoded, roi=(4, 8, 10, 12)), decoded[:, 4:14, 8:20]
+    )
+    out = torch.empty_like(image)
+    lrf.imf_decode(encoded, out=out, workspace=lrf.DecodeWorkspace())
+    assert torch.equal(out, decoded)
+    assert lrf.imf_decode(encoded, integer=True).shape == image.shape
+    assert lrf.imf_decode(encoded, scale=2).shape == (3, 20, 28)
+    assert lrf.imf_decode(encoded, max_rank=2).shape == image.shape
+
+
+test_imf_encode_batch()
+test_imf_encode_nested()
+test_imf_decode_integer()
+test_combine_bytes()
+test_load()
+test_entropy_coders()
+test_pack_bits()
+test_image_header()
+test_zlib_dictionary()
+test_dpcm()
+test_layers()
+test_imf_decode_roi()
+test_imf_decode_scale()
+test_imf_decode_batch()
+test_decode_out()
+test_reconstruct_strips()
+test_imf_decode_pipelined()
+test_imf_rgb_no_patch()
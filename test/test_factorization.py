@@ -1,3 +1,5 @@
+import warnings
+
 import torch
 
 import lrf
@@ -6,8 +8,98 @@ import lrf
 def test_imf():
     x = torch.randint(0, 256, size=(1, 784, 192))
     imf = lrf.IMF(rank=5, num_iters=10, verbose=True)
-    u, v = imf.decompose(x)
-    return u, v
+    u, v, w = imf.decompose(x)
+    return u, v, w
+
+
+def test_imf_update_w():
+    x = torch.randint(0, 256, size=(2, 784, 192)).float()
+    u = torch.randint(-16, 16, size=(2, 784, 5)).float()
+    v = torch.randint(-16, 16, size=(2, 192, 5)).float()
+    w = lrf.CoordinateDescent().update_w(x, u, v, None)
+    z = (u @ v.mT).flatten(-2, -1).unsqueeze(-1).double()
+    a = torch.cat([torch.ones_like(z), z], dim=-1)
+    b = x.flatten(-2, -1).unsqueeze(-1).double()
+    w_lstsq = torch.linalg.lstsq(a, b).solution
+    assert torch.allclose(w.double(), w_lstsq, rtol=1e-4)
+
+
+def test_imf_losses():
+    x = torch.randint(0, 256, size=(2, 784, 192))
+    imf = lrf.IMF(rank=5, num_iters=10, bounds=(-16, 15), tol=0, patience=2)
+    u, v, w, losses = imf.decompose(x, return_losses=True)
+    assert losses.shape[-1] == 2 and 1 <= losses.shape[0] <= 10
+    loss = imf.loss(x.double(), u.double(), v.double(), w.double())
+    assert torch.allclose(losses[-1], loss, atol=1e-6)
+
+
+def test_imf_block_sweep():
+    x = torch.randint(0, 256, size=(2, 784, 192))
+    imf = lrf.IMF(rank=8, num_iters=5, bounds=(-16, 15), factor=(0, 1), block_size=3)
+    u, v, w, losses = imf.decompose(x, return_losses=True)
+    assert torch.equal(u, u.round()) and u.abs().max() <= 16
+    assert torch.all(losses[1:] <= losses[:-1] + 1e-6)
+
+
+def test_imf_compiled_sweep():
+    x = torch.randint(0, 256, size=(2, 100, 48))
+    kwargs = dict(rank=3, num_iters=3, bounds=(-16, 15))
+    factors = lrf.IMF(**kwargs).decompose(x)
+
+    # if torch.compile fails, the sweep falls back to eager mode with a warning
+    compile = torch.compile
+
+    def failing_compile(*args, **kwargs):
+        raise RuntimeError("torch.compile is unavailable")
+
+    torch.compile = failing_compile
+    try:
+        imf = lrf.IMF(compile=True, **kwargs)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            eager_factors = imf.decompose(x)
+    finally:
+        torch.compile = compile
+    assert caught and not imf.solver.compile
+    assert all(torch.equal(a, b) for a, b in zip(eager_factors, factors))
+
+    # the compiled sweep, where compilation is available, gives the same factors
+    imf = lrf.IMF(compile=True, **kwargs)
+    compiled_factors = imf.decompose(x)
+    assert all(torch.equal(a, b) for a, b in zip(compiled_factors, factors))
+
+
+def test_bucketed_imf():
+    xs = [torch.rand(2, 100, 64) * 255, torch.rand(37, 64) * 255, torch.rand(50, 48) * 255]
+    outputs = lrf.bucketed_imf(xs, [5, 5, 3], bounds=(-16, 15), factor=(0, 1))
+    for x, (u, v, w, losses) in zip(xs, outputs):
+        assert u.shape == (*x.shape[:-1], u.shape[-1]) and v.shape[-2] == x.shape[-1]
+        loss = lrf.IMF.loss(x.double(), u.double(), v.double(), w.double())
+        assert torch.allclose(losses[-1], loss, atol=1e-4)
+
+
+def test_bucketed_imf_rank_deficient():
+    # fewer rows than the rank, so V has zero columns, padded to share a bucket
+    xs = [torch.rand(3, 16) * 255, torch.rand(20, 16) * 255, torch.rand(2, 5, 16) * 255]
+    outputs = lrf.bucketed_imf(xs, [6, 6, 6], bounds=(-16, 15), factor=(0, 1))
+    imf = lrf.IMF(rank=6, bounds=(-16, 15), factor=(0, 1))
+    for x, (u, v, w, losses) in zip(xs, outputs):
+        u_solo, v_solo, _, losses_solo = imf.decompose(x, return_losses=True)
+        assert torch.equal(u, u_solo) and torch.equal(v, v_solo)
+        assert torch.allclose(losses, losses_solo)
+
+
+def test_imf_chunked():
+    x = torch.randint(0, 256, size=(1000, 64), dtype=torch.uint8)
+    imf = lrf.IMF(rank=5, num_iters=5, bounds=(-16, 15))
+    *_, losses_dense = imf.decompose(x, return_losses=True)
+    u, v, w, losses = imf.decompose(
+        lrf.ChunkedMatrix(x.numpy(), chunk_size=300), return_losses=True
+    )
+    assert u.shape == (1000, 5) and v.shape == (64, 5)
+    assert torch.allclose(losses, losses_dense, atol=1e-3)
+    loss = imf.loss(x.double(), u.double(), v.double(), w.double())
+    assert torch.allclose(losses[-1], loss, atol=1e-6)
 
 
 def test_hosvd_rank_upper_bounds():
@@ -54,6 +146,13 @@ def test_batched_ttd():
 
 
 test_imf()
+test_imf_update_w()
+test_imf_losses()
+test_imf_block_sweep()
+test_imf_compiled_sweep()
+test_bucketed_imf()
+test_bucketed_imf_rank_deficient()
+test_imf_chunked()
 test_hosvd()
 test_batched_hosvd()
 test_hosvd_rank_upper_bounds()